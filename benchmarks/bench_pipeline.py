@@ -0,0 +1,510 @@
+"""Offline end-to-end benchmark of the comment pipeline.
+
+Starts a local stand-in for a Hive API node (block_api.get_block_range,
+get_dynamic_global_properties, content and history lookups) serving synthetic
+blocks, a fake talk-to-gpt endpoint with configurable latency and output length,
+and an in-memory Supabase. The real listener, reply, reply pool, broadcaster and
+leosub code then runs against them the way main() does, with the broadcaster's
+Hive client replaced by one that writes replies into the synthetic chain.
+
+Reports mentions per second, p50/p99 mention-to-reply latency and Hive RPC
+calls per mention for each mention count:
+
+    python benchmarks/bench_pipeline.py --mentions 1,10,100,1000 --llm-latency 0.5
+
+Mention-to-reply latency runs from the moment a mention's block is produced to
+the moment its reply is handed to the chain. By default every mention block
+exists when a run starts (a backlog), which measures throughput; --live
+produces them one every --block-interval seconds instead, which measures
+latency at the head.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The repository modules are imported after the stand-ins are configured
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Constants
+BOT_ACCOUNT = 'llamathreads'
+CONTAINER_AUTHOR = 'leothreads'  # Blacklisted in the chain walk, like the real container posts
+CONTAINER_PERMLINK = 'bench-container'
+BENCH_START_BLOCK = 90000000  # Far from any real block numbers, every run gets its own range
+RUN_BLOCK_SPACING = 1000000
+FILLER_WORDS = ('hive', 'block', 'thread', 'token', 'chain', 'summary', 'price', 'vote', 'reward', 'community', 'question', 'answer')
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def encode(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+class MemorySupabase:
+    """In-memory stand-in for the subset of the Supabase client the bot uses."""
+
+    PRIMARY_KEYS = {'subscribers': 'username', 'freetrial': 'username', 'buyers': 'username', 'processed_transfers': 'tx_id'}
+
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+    def table(self, name):
+        return MemoryQuery(self, name)
+
+class MemoryQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table_name = table
+        self.action = 'select'
+        self.payload = None
+        self.conflict_key = client.PRIMARY_KEYS.get(table, '_id')
+        self.filters = []
+
+    def select(self, columns='*'):
+        self.action = 'select'
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.action = 'upsert'
+        self.payload = rows if isinstance(rows, list) else [rows]
+        self.conflict_key = on_conflict or self.conflict_key
+        return self
+
+    def insert(self, rows):
+        self.action = 'insert'
+        self.payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values):
+        self.action = 'update'
+        self.payload = values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row.get(column)) < str(value))
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def execute(self):
+        client = self.client
+        with client.lock:
+            client.calls[f"{self.action} {self.table_name}"] += 1
+            rows = client.tables.setdefault(self.table_name, [])
+            matched = [row for row in rows if all(check(row) for check in self.filters)]
+            if self.action == 'select':
+                data = [dict(row) for row in matched]
+            elif self.action == 'delete':
+                client.tables[self.table_name] = [row for row in rows if row not in matched]
+                data = matched
+            elif self.action == 'insert':
+                rows.extend(dict(row) for row in self.payload)
+                data = self.payload
+            elif self.action == 'update':
+                for row in matched:
+                    row.update(self.payload)
+                data = [dict(row) for row in matched]
+            else:
+                by_key = {row.get(self.conflict_key): row for row in rows}
+                for row in self.payload:
+                    existing = by_key.get(row.get(self.conflict_key))
+                    if existing is None:
+                        rows.append(dict(row))
+                        by_key[row.get(self.conflict_key)] = rows[-1]
+                    else:
+                        existing.update(row)
+                data = self.payload
+        return SimpleNamespace(data=data, status_code=200, message='')
+
+class BenchChain:
+    """Synthetic chain of one benchmark run.
+
+    Blocks carry `noise` unrelated comments each, and the planned mentions of the
+    bot spread over `windows` windows of `block_range` blocks. Replies posted by
+    the bot land in the block after the current head.
+    """
+
+    def __init__(self, start_block, mentions_per_window, windows, block_range, noise, subscriber_ratio,
+                 prompt_chars, block_interval, live, run_index, seed):
+        self.start_block = start_block
+        self.block_interval = block_interval
+        self.planned_blocks = windows * block_range
+        self.preloaded = 1 if live else self.planned_blocks
+        self.noise = noise
+        self.run_index = run_index
+        self.started_at = None
+        self.lock = threading.Lock()
+        self.encoded = {}
+        self.extra_ops = {}  # block_num -> operations added after the run started
+        self.content = {}  # "author/permlink" -> condenser post
+        self.mentions = {}  # "author/permlink" -> block_num
+        self.operations = {}  # block_num -> planned operations
+        self.subscribers = set()
+        self.replies = {}  # parent "author/permlink" -> time of the reply
+        self.all_replied = threading.Event()
+        rng = random.Random(seed + run_index)
+        self._add_post(CONTAINER_AUTHOR, CONTAINER_PERMLINK, '', 'leothreads', 'Container post of the benchmark.')
+        threads = max(1, mentions_per_window // 4)
+        for thread in range(threads):
+            self._add_post(f"poster{thread % 50}", f"run{run_index}-thread{thread}", CONTAINER_AUTHOR, CONTAINER_PERMLINK,
+                           ' '.join(rng.choice(FILLER_WORDS) for _ in range(40)))
+        users = max(1, mentions_per_window)
+        for user in range(users):
+            if rng.random() < subscriber_ratio:
+                self.subscribers.add(f"user{user}")
+        for window in range(windows):
+            for index in range(mentions_per_window):
+                block_num = start_block + window * block_range + index * block_range // mentions_per_window
+                author = f"user{rng.randrange(users)}"
+                thread = rng.randrange(threads)
+                permlink = f"run{run_index}-mention-{window}-{index}"
+                words = ' '.join(rng.choice(FILLER_WORDS) for _ in range(max(1, prompt_chars // 7)))
+                body = f"@{BOT_ACCOUNT} question {window}-{index} of run {run_index}: {words}"[:max(prompt_chars, 40)]
+                operation = self._add_post(author, permlink, f"poster{thread % 50}", f"run{run_index}-thread{thread}", body)
+                self.operations.setdefault(block_num, []).append(operation)
+                self.mentions[f"{author}/{permlink}"] = block_num
+
+    def _add_post(self, author, permlink, parent_author, parent_permlink, body):
+        parent = self.content.get(f"{parent_author}/{parent_permlink}")
+        root_author, root_permlink = (parent['root_author'], parent['root_permlink']) if parent else (author, permlink)
+        self.content[f"{author}/{permlink}"] = {
+            'author': author, 'permlink': permlink, 'parent_author': parent_author, 'parent_permlink': parent_permlink,
+            'root_author': root_author, 'root_permlink': root_permlink, 'body': body,
+            'depth': parent['depth'] + 1 if parent else 0, 'json_metadata': '{"app":"leothreads/0.3"}'
+        }
+        return {'type': 'comment_operation', 'value': {
+            'parent_author': parent_author, 'parent_permlink': parent_permlink, 'author': author, 'permlink': permlink,
+            'title': '', 'body': body, 'json_metadata': '{"app":"leothreads/0.3"}'}}
+
+    def start(self):
+        self.started_at = time.monotonic()
+
+    def head(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.start_block + self.preloaded - 1 + int(elapsed / self.block_interval)
+
+    def produced_at(self, block_num):
+        return self.started_at + max(0, block_num - (self.start_block + self.preloaded - 1)) * self.block_interval
+
+    def block(self, block_num):
+        """Return the raw block_api JSON of a produced block."""
+        cached = self.encoded.get(block_num)
+        if cached is not None:
+            return cached
+        operations = list(self.operations.get(block_num, []))
+        for index in range(self.noise):
+            operations.append({'type': 'comment_operation', 'value': {
+                'parent_author': f"poster{index % 50}", 'parent_permlink': f"chatter-{block_num}",
+                'author': f"noise{index}", 'permlink': f"noise-{block_num}-{index}", 'title': '',
+                'body': ' '.join(FILLER_WORDS[(block_num + index + word) % len(FILLER_WORDS)] for word in range(30)),
+                'json_metadata': '{"app":"leothreads/0.3"}'}})
+        with self.lock:
+            operations.extend(self.extra_ops.get(block_num, []))
+        timestamp = (datetime(2030, 1, 1) + timedelta(seconds=3 * (block_num - self.start_block))).strftime('%Y-%m-%dT%H:%M:%S')
+        transactions = [{'ref_block_num': block_num & 0xffff, 'ref_block_prefix': 0, 'expiration': timestamp,
+                         'operations': [operation], 'extensions': [], 'signatures': []} for operation in operations]
+        block = encode({
+            'previous': f"{block_num - 1:08x}" + '0' * 32, 'timestamp': timestamp, 'witness': 'bench',
+            'transaction_merkle_root': '0' * 40, 'extensions': [], 'witness_signature': '', 'transactions': transactions,
+            'block_id': f"{block_num:08x}" + '0' * 32, 'signing_key': '',
+            'transaction_ids': [f"{block_num:08x}{index:032x}" for index in range(len(transactions))]})
+        # Blocks below the head no longer change
+        if block_num < self.head():
+            self.encoded[block_num] = block
+        return block
+
+    def record_reply(self, author, permlink, parent_id, body):
+        """Put a reply of the bot into the next block and note when it was posted."""
+        posted_at = time.monotonic()
+        parent_author, parent_permlink = parent_id.split('/', 1)
+        operation = self._add_post(author, permlink, parent_author, parent_permlink, body)
+        with self.lock:
+            self.extra_ops.setdefault(self.head() + 1, []).append(operation)
+            self.replies.setdefault(parent_id, posted_at)
+            if all(mention in self.replies for mention in self.mentions):
+                self.all_replied.set()
+
+class BenchPoster:
+    """Hive client stand-in for the broadcaster, posting into the benchmark chain."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def post(self, title, body, author, permlink, reply_identifier, json_metadata=None):
+        self.server.chain.record_reply(author, permlink, reply_identifier, body)
+        return {'permlink': permlink}
+
+class BenchServer:
+    """Local Hive API node and talk-to-gpt endpoint in one HTTP server."""
+
+    def __init__(self, llm_latency, llm_chars, llm_chunks):
+        self.chain = None
+        self.llm_latency = llm_latency
+        self.llm_chars = llm_chars
+        self.llm_chunks = llm_chunks
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        bench = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+                if self.path.endswith('/talk-to-gpt'):
+                    bench.count('talk-to-gpt')
+                    self._stream(bench.answer(body))
+                    return
+                if isinstance(body, list):
+                    payload = b'[' + b','.join(bench.rpc(call) for call in body) + b']'
+                else:
+                    payload = bench.rpc(body)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, chunks):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(sum(len(chunk) for chunk in chunks)))
+                self.end_headers()
+                for chunk in chunks:
+                    time.sleep(bench.llm_latency / len(chunks))
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, name='bench-server', daemon=True).start()
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls)
+
+    def answer(self, request):
+        sentence = 'This is a synthetic answer about ' + ' '.join(FILLER_WORDS[:4]) + '. '
+        text = (sentence * (self.llm_chars // len(sentence) + 1))[:self.llm_chars]
+        data = (text + '<NanoGPT>{"cost":0}').encode('utf-8')
+        size = max(1, len(data) // self.llm_chunks)
+        return [data[index:index + size] for index in range(0, len(data), size)]
+
+    def rpc(self, call):
+        method = call.get('method')
+        params = call.get('params')
+        self.count(method)
+        chain = self.chain
+        if method == 'block_api.get_block_range':
+            first = params['starting_block_num']
+            last = min(first + params['count'] - 1, chain.head())
+            blocks = b','.join(chain.block(block_num) for block_num in range(first, last + 1))
+            return b'{"jsonrpc":"2.0","result":{"blocks":[' + blocks + b']},"id":' + encode(call.get('id', 1)) + b'}'
+        result = self.result(method, params, chain)
+        return encode({'jsonrpc': '2.0', 'result': result, 'id': call.get('id', 1)})
+
+    def result(self, method, params, chain):
+        if method in ('condenser_api.get_dynamic_global_properties', 'database_api.get_dynamic_global_properties'):
+            head = chain.head()
+            return {'head_block_number': head, 'last_irreversible_block_num': head - 20, 'time': '2030-01-01T00:00:00'}
+        if method == 'condenser_api.get_content':
+            return chain.content.get(f"{params[0]}/{params[1]}") or {'author': '', 'permlink': ''}
+        if method == 'bridge.get_discussion':
+            root = (params['author'], params['permlink'])
+            return {key: post for key, post in chain.content.items() if (post['root_author'], post['root_permlink']) == root}
+        if method == 'condenser_api.get_account_history':
+            return []
+        if method == 'account_history_api.get_account_history':
+            return {'history': []}
+        if method == 'bridge.get_account_posts':
+            return []
+        if method == 'database_api.get_config':
+            return {'HIVE_CHAIN_ID': 'beeab0de' + '0' * 56, 'HIVE_ADDRESS_PREFIX': 'STM', 'HIVE_BLOCKCHAIN_VERSION': '1.27.0'}
+        if method == 'database_api.find_accounts':
+            return {'accounts': [{'name': name, 'id': index} for index, name in enumerate(params['accounts'])]}
+        return None
+
+def configure_environment(server, args, workdir):
+    """Point every module at the stand-ins, before the modules read their settings."""
+    from beemgraphenebase.account import PrivateKey
+    import supabase
+    os.environ.update({
+        'HIVE_API_NODES': server.url,
+        'ACCOUNT': BOT_ACCOUNT,
+        'POSTING_KEY': str(PrivateKey()),
+        'ACTIVE_KEY': str(PrivateKey()),
+        'API_KEY': 'bench',
+        'SUPABASE_URL': 'http://127.0.0.1',
+        'SUPABASE_KEY': 'bench',
+        'REPLY_WORKERS': str(args.workers),
+        'BLOCK_STORE_DIR': os.path.join(workdir, 'block_store'),
+        'CHECKPOINT_DB': os.path.join(workdir, 'checkpoints.sqlite3'),
+        'CONVERSATION_DB': os.path.join(workdir, 'conversations.sqlite3'),
+        'METRICS_PORT': '0',
+        'METRICS_FILE': '',
+    })
+    memory = MemorySupabase()
+    supabase.create_client = lambda url, key: memory
+    return memory
+
+def run_scale(server, memory, mentions_per_window, run_index, args):
+    """Run the pipeline over one synthetic chain and return its measurements."""
+    import reply
+    from listener import BlockPrefetcher
+    from main import process_window, BLOCK_RANGE
+    from reply_pool import ReplyPool
+    from subscriptions import SubscriptionIndex
+    from broadcaster import broadcaster
+
+    chain = BenchChain(BENCH_START_BLOCK + run_index * RUN_BLOCK_SPACING, mentions_per_window, args.windows, BLOCK_RANGE,
+                       args.noise, args.subscriber_ratio, args.prompt_chars, args.block_interval, args.live, run_index, args.seed)
+    now = datetime.utcnow().isoformat()
+    memory.tables['subscribers'] = [{'username': username, 'timestamp': now} for username in sorted(chain.subscribers)]
+    server.chain = chain
+    # The clock restarts below, the head only has to be readable during the refresh
+    chain.start()
+    reply.BASE_URL = f"{server.url}/api"
+    broadcaster.hive = BenchPoster(server)
+
+    # The subscriber refresh goes through leosub against the stand-ins
+    refresh_start = time.monotonic()
+    subscriptions = SubscriptionIndex()
+    subscriptions.refresh()
+    refresh_seconds = time.monotonic() - refresh_start
+
+    pool = ReplyPool()
+    calls_before = server.snapshot()
+    chain.start()
+    start = time.monotonic()
+    prefetcher = BlockPrefetcher(chain.start_block, BLOCK_RANGE, follow=True, poll_interval=args.block_interval)
+    timed_out = False
+    try:
+        # Each window goes through the same function as in main()
+        for window in prefetcher:
+            process_window(window, subscriptions, pool, follow=True)
+            if chain.all_replied.is_set():
+                break
+            if time.monotonic() - start > args.timeout:
+                timed_out = True
+                break
+    finally:
+        prefetcher.stop()
+        pool.shutdown()
+    elapsed = time.monotonic() - start
+    calls = server.snapshot() - calls_before
+    latencies = [chain.replies[mention] - chain.produced_at(block_num) for mention, block_num in chain.mentions.items() if mention in chain.replies]
+    mentions = len(chain.mentions)
+    rpc_calls = sum(count for method, count in calls.items() if method != 'talk-to-gpt')
+    return {
+        'mentions_per_window': mentions_per_window,
+        'mentions': mentions,
+        'replied': len(latencies),
+        'timed_out': timed_out,
+        'seconds': round(elapsed, 3),
+        'mentions_per_second': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_p50': round(percentile(latencies, 0.5), 3) if latencies else None,
+        'latency_p99': round(percentile(latencies, 0.99), 3) if latencies else None,
+        'rpc_per_mention': round(rpc_calls / mentions, 2) if mentions else None,
+        'llm_calls': calls.get('talk-to-gpt', 0),
+        'subscription_refresh_seconds': round(refresh_seconds, 3),
+        'rpc_calls': dict(calls.most_common()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mentions', default='1,10,100,1000', help='Comma separated mentions per window, one run each')
+    parser.add_argument('--windows', type=int, default=3, help='Windows of mentions per run')
+    parser.add_argument('--noise', type=int, default=40, help='Unrelated comments per block')
+    parser.add_argument('--subscriber-ratio', type=float, default=0.8, help='Share of mention authors with a subscription')
+    parser.add_argument('--prompt-chars', type=int, default=200, help='Length of a mention body')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds the fake talk-to-gpt takes per answer')
+    parser.add_argument('--llm-chars', type=int, default=800, help='Characters of a fake answer')
+    parser.add_argument('--llm-chunks', type=int, default=8, help='Chunks an answer is streamed in')
+    parser.add_argument('--workers', type=int, default=4, help='REPLY_WORKERS of the reply pool')
+    parser.add_argument('--reply-interval', type=float, default=0.0, help='Seconds between replies, the chain enforces 3')
+    parser.add_argument('--block-interval', type=float, default=0.05, help='Seconds between synthetic blocks')
+    parser.add_argument('--live', action='store_true', help='Produce mention blocks over time instead of as a backlog')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds a run may take')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='Keep the log output of the pipeline')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-pipeline-')
+    server = BenchServer(args.llm_latency, args.llm_chars, args.llm_chunks)
+    memory = configure_environment(server, args, workdir)
+    report = sys.stdout
+    results = []
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                logging.disable(logging.CRITICAL)
+                stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+            from outbox import reply_pacer
+            from broadcaster import broadcaster
+            reply_pacer.interval = args.reply_interval
+            try:
+                for run_index, mentions_per_window in enumerate(int(value) for value in args.mentions.split(',')):
+                    result = run_scale(server, memory, mentions_per_window, run_index, args)
+                    results.append(result)
+                    if not args.json:
+                        print(f"{mentions_per_window} mentions per window: {result['replied']}/{result['mentions']} replied "
+                              f"in {result['seconds']}s", file=report, flush=True)
+            finally:
+                broadcaster.stop()
+    finally:
+        logging.disable(logging.NOTSET)
+        server.server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print()
+    print(f"{'mentions/window':>15} {'mentions':>8} {'replied':>7} {'mentions/s':>10} {'p50 s':>8} {'p99 s':>8} {'rpc/mention':>11} {'llm calls':>9}")
+    for result in results:
+        print(f"{result['mentions_per_window']:>15} {result['mentions']:>8} {result['replied']:>7} {result['mentions_per_second']!s:>10} "
+              f"{result['latency_p50']!s:>8} {result['latency_p99']!s:>8} {result['rpc_per_mention']!s:>11} {result['llm_calls']:>9}"
+              + ('  (timed out)' if result['timed_out'] else ''))
+    print()
+    for result in results:
+        calls = ', '.join(f"{method}: {count}" for method, count in result['rpc_calls'].items())
+        print(f"RPC calls at {result['mentions_per_window']} mentions per window: {calls}")
+
+if __name__ == '__main__':
+    main()
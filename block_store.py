@@ -0,0 +1,158 @@
+import os
+import sys
+import glob
+import mmap
+import struct
+import threading
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+BLOCK_STORE_DIR = os.getenv('BLOCK_STORE_DIR', 'block_store')
+BLOCK_STORE_ENABLED = os.getenv('BLOCK_STORE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SEGMENT_BLOCKS = 10000  # Blocks per segment, about 8 hours of chain
+BLOCK_STORE_MAX_SEGMENTS = int(os.getenv('BLOCK_STORE_MAX_SEGMENTS', 21))  # Oldest segments beyond this are dropped, 0 keeps all
+INDEX_RECORD = struct.Struct('<QI')  # Offset and length of one block in its data file, a length of 0 marks a gap
+
+class BlockStore:
+    """Append-only on-disk store of irreversible blocks in their raw JSON form.
+
+    Blocks are grouped in segments of SEGMENT_BLOCKS. Each segment has a data
+    file with the block bytes back to back and a dense index file with one
+    INDEX_RECORD per block number, so a lookup is one index read and one slice.
+    Both files are read through memory maps. Block bytes are only ever appended
+    and every index record is written once: a block arriving after a later one
+    (parallel fetches finish out of order) fills its gap record in place.
+    """
+
+    def __init__(self, path=BLOCK_STORE_DIR, max_segments=BLOCK_STORE_MAX_SEGMENTS):
+        self.path = path
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.writers = {}  # segment -> (data file, index file) open for appending
+        self.maps = {}  # (segment, kind) -> mmap
+        os.makedirs(path, exist_ok=True)
+
+    def _files(self, segment):
+        base = os.path.join(self.path, f"segment-{segment * SEGMENT_BLOCKS:010d}")
+        return base + '.dat', base + '.idx'
+
+    def _writer(self, segment):
+        writer = self.writers.get(segment)
+        if writer is None:
+            data_path, index_path = self._files(segment)
+            data_file = open(data_path, 'ab')
+            # Not opened for appending, gap records are rewritten in place; O_BINARY keeps Windows from translating bytes
+            index_file = open(os.open(index_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644), 'r+b')
+            index_file.seek(0, os.SEEK_END)
+            # A crash can leave half an index record behind, drop it
+            index_file.truncate(index_file.tell() - index_file.tell() % INDEX_RECORD.size)
+            # Only the newest segment is written to, close the others
+            for old_segment in list(self.writers):
+                for handle in self.writers.pop(old_segment):
+                    handle.close()
+            writer = self.writers[segment] = (data_file, index_file)
+            self._prune(keep=segment)
+        return writer
+
+    def _prune(self, keep):
+        if not self.max_segments:
+            return
+        index_paths = sorted(glob.glob(os.path.join(self.path, 'segment-*.idx')))
+        for index_path in index_paths[:-self.max_segments]:
+            segment = int(os.path.basename(index_path)[8:18]) // SEGMENT_BLOCKS
+            if segment == keep:
+                continue
+            for kind in ('dat', 'idx'):
+                mapped = self.maps.pop((segment, kind), None)
+                if mapped is not None:
+                    mapped.close()
+            for file_path in self._files(segment):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            logger.info(f"Dropped block store segment starting at {segment * SEGMENT_BLOCKS}.")
+
+    def append(self, block_num, data):
+        """Store the raw bytes of an irreversible block, returning False if its slot is already taken."""
+        segment, slot = divmod(block_num, SEGMENT_BLOCKS)
+        with self.lock:
+            data_file, index_file = self._writer(segment)
+            end = index_file.tell()
+            next_slot = end // INDEX_RECORD.size
+            if slot < next_slot:
+                index_file.seek(slot * INDEX_RECORD.size)
+                record = index_file.read(INDEX_RECORD.size)
+                index_file.seek(end)
+                if INDEX_RECORD.unpack(record)[1]:
+                    return False
+            offset = data_file.tell()
+            data_file.write(data)
+            data_file.flush()
+            if slot < next_slot:
+                # The index handle stays positioned at its end between appends
+                index_file.seek(slot * INDEX_RECORD.size)
+                index_file.write(INDEX_RECORD.pack(offset, len(data)))
+                index_file.flush()
+                index_file.seek(end)
+                return True
+            # Blocks that were never stored stay readable as gaps
+            index_file.write(INDEX_RECORD.pack(0, 0) * (slot - next_slot) + INDEX_RECORD.pack(offset, len(data)))
+            index_file.flush()
+            return True
+
+    def _map(self, segment, kind, size_needed):
+        """Return a read-only map of a segment file that covers size_needed bytes, or None."""
+        mapped = self.maps.get((segment, kind))
+        if mapped is not None and len(mapped) >= size_needed:
+            return mapped
+        file_path = self._files(segment)[0 if kind == 'dat' else 1]
+        if not os.path.exists(file_path) or os.path.getsize(file_path) < size_needed:
+            return None
+        # The file grew since it was last mapped, map it again
+        if mapped is not None:
+            mapped.close()
+        with open(file_path, 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[(segment, kind)] = mapped
+        return mapped
+
+    def get(self, block_num):
+        """Return the raw bytes of a stored block, or None."""
+        segment, slot = divmod(block_num, SEGMENT_BLOCKS)
+        with self.lock:
+            index = self._map(segment, 'idx', (slot + 1) * INDEX_RECORD.size)
+            if index is None:
+                return None
+            offset, length = INDEX_RECORD.unpack_from(index, slot * INDEX_RECORD.size)
+            if not length:
+                return None
+            data = self._map(segment, 'dat', offset + length)
+            if data is None:
+                return None
+            return data[offset:offset + length]
+
+    def read_range(self, start_block, end_block):
+        """Return the raw bytes of the stored blocks from start_block on, stopping at the first missing one."""
+        blocks = []
+        for block_num in range(start_block, end_block + 1):
+            data = self.get(block_num)
+            if data is None:
+                break
+            blocks.append(data)
+        return blocks
+
+    def close(self):
+        with self.lock:
+            for handles in self.writers.values():
+                for handle in handles:
+                    handle.close()
+            self.writers.clear()
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+
+# Shared store used by the listener, None when disabled
+block_store = BlockStore() if BLOCK_STORE_ENABLED else None
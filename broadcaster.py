@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import queue
+import threading
+import logging
+from datetime import datetime
+from beem import Hive
+from beem.exceptions import MissingKeyError
+from dotenv import load_dotenv
+from hive_rpc import router
+from outbox import reply_pacer
+from checkpoint_log import checkpoint_log
+from metrics import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Load environment variables
+load_dotenv()
+
+ACCOUNT = os.getenv('ACCOUNT')
+POSTING_KEY = os.getenv('POSTING_KEY')
+
+# Constants
+CONFIRM_TIMEOUT = int(os.getenv('CONFIRM_TIMEOUT', 120))  # Seconds a broadcast reply may stay unseen in the fetched blocks
+
+class ReplyBroadcaster:
+    """Long-lived posting client that broadcasts queued replies in order.
+
+    Replies are paced to the chain's per-account comment interval, shared with
+    the subscription notifications, instead of sleeping after every post.
+    Inclusion is confirmed asynchronously: the listener reports every
+    comment_operation it sees and the broadcaster matches the ones written by
+    its own account.
+    """
+
+    def __init__(self, account=ACCOUNT, posting_key=POSTING_KEY, pacer=reply_pacer):
+        self.account = account
+        self.posting_key = posting_key
+        self.pacer = pacer
+        self.queue = queue.Queue()
+        self.pending = {}  # permlink -> (parent id, broadcast time)
+        self.lock = threading.Lock()
+        self.hive = None
+        self.thread = None
+
+    def _client(self):
+        if self.hive is None:
+            self.hive = Hive(node=router.ranked(), keys=[self.posting_key])
+        return self.hive
+
+    def submit(self, parent_comment, reply_text):
+        """Queue a reply and return the permlink it will be posted under."""
+        # Generate a unique permlink for your comment and convert it to lowercase
+        permlink = f"re-{parent_comment['author']}-{parent_comment['permlink']}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}"
+        permlink = permlink.lower()
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+                self.thread.start()
+        self.queue.put((parent_comment, permlink, reply_text))
+        metrics.set('broadcast_queue_depth', self.queue.qsize())
+        return permlink
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._post(*item)
+            finally:
+                self.queue.task_done()
+                metrics.set('broadcast_queue_depth', self.queue.qsize())
+
+    def _post(self, parent_comment, permlink, reply_text):
+        # The chain rejects a second comment of the same account within the reply interval
+        self.pacer.wait()
+        parent_id = f"{parent_comment['author']}/{parent_comment['permlink']}"
+        try:
+            with metrics.timed('broadcast'):
+                result = self._client().post(
+                    title="",  # Leave empty for a comment
+                    body=reply_text,
+                    author=self.account,
+                    permlink=permlink,
+                    reply_identifier=parent_id,
+                    json_metadata={"app": "leothreads/0.3"}  # Use Leothreads interface for posting to the blockchain
+                )
+            with self.lock:
+                self.pending[permlink] = (parent_id, time.monotonic())
+                metrics.set('unconfirmed_replies', len(self.pending))
+            checkpoint_log.mark(parent_id, 'broadcast', permlink)
+            logger.info(f"Reply posted successfully: {result}")
+        except MissingKeyError:
+            logger.error("Missing posting key. Please check your POSTING_KEY in the .env file.")
+        except Exception as e:
+            logger.error(f"An error occurred while posting the reply to @{parent_id}: {e}")
+            logger.debug(str(e))
+            # Pick up the current node ranking for the next reply
+            self.hive = None
+
+    def observe(self, author, permlink):
+        """Confirm a reply once its comment_operation shows up in a fetched block."""
+        if author != self.account:
+            return
+        with self.lock:
+            entry = self.pending.pop(permlink, None)
+            metrics.set('unconfirmed_replies', len(self.pending))
+        if entry:
+            checkpoint_log.mark(entry[0], 'confirmed')
+            metrics.observe('broadcast_confirm_seconds', time.monotonic() - entry[1])
+            logger.info(f"Reply to @{entry[0]} confirmed on chain after {time.monotonic() - entry[1]:.1f}s.")
+
+    def unconfirmed(self, older_than=CONFIRM_TIMEOUT):
+        """Pop and return the permlinks of replies not seen on chain within older_than seconds."""
+        cutoff = time.monotonic() - older_than
+        with self.lock:
+            stale = [permlink for permlink, (_, broadcast_at) in self.pending.items() if broadcast_at < cutoff]
+            for permlink in stale:
+                del self.pending[permlink]
+            metrics.set('unconfirmed_replies', len(self.pending))
+        return stale
+
+    def flush(self):
+        """Block until every queued reply has been broadcast."""
+        self.queue.join()
+
+    def stop(self):
+        """Broadcast the remaining replies and stop the worker."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+# Shared broadcaster used by the reply code and the listener
+broadcaster = ReplyBroadcaster()
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+CHECKPOINT_DB = os.getenv('CHECKPOINT_DB', 'checkpoints.sqlite3')
+CHECKPOINT_FLUSH_INTERVAL = int(os.getenv('CHECKPOINT_FLUSH_INTERVAL', 60))  # Seconds between cursor uploads to Supabase
+CHECKPOINT_TTL = int(os.getenv('CHECKPOINT_TTL', 7 * 24 * 3600))  # Comment states older than this are dropped
+
+# Reply states in the order a comment goes through them
+STATES = ('seen', 'generated', 'broadcast', 'confirmed')
+
+class CheckpointLog:
+    """Local write-ahead log of the block cursor and the reply state of every comment.
+
+    Writes are cheap SQLite WAL commits, so every window and every reply step is
+    recorded locally. The cursor only goes to Supabase every
+    CHECKPOINT_FLUSH_INTERVAL seconds and on shutdown; after a crash the local
+    cursor wins if it is ahead, and comments already broadcast are skipped.
+    """
+
+    def __init__(self, path=CHECKPOINT_DB, flush_interval=CHECKPOINT_FLUSH_INTERVAL, ttl=CHECKPOINT_TTL):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.flushed_cursor = None
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS comment_states (
+                comment_id TEXT PRIMARY KEY,
+                state INTEGER NOT NULL,
+                reply_permlink TEXT,
+                updated_at REAL NOT NULL
+            )""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS cursor (
+                name TEXT PRIMARY KEY,
+                block_num INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+
+    def mark(self, comment_id, state, reply_permlink=None):
+        """Move a comment forward to state; a comment never moves back."""
+        level = STATES.index(state)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO comment_states (comment_id, state, reply_permlink, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (comment_id) DO UPDATE SET state = excluded.state, "
+                "reply_permlink = COALESCE(excluded.reply_permlink, reply_permlink), updated_at = excluded.updated_at "
+                "WHERE excluded.state > comment_states.state",
+                (comment_id, level, reply_permlink, time.time()))
+
+    def state(self, comment_id):
+        """Return the recorded state of a comment, or None."""
+        with self.lock:
+            row = self.connection.execute("SELECT state FROM comment_states WHERE comment_id = ?", (comment_id,)).fetchone()
+        return STATES[row[0]] if row else None
+
+    def is_broadcast(self, comment_id):
+        return self.state(comment_id) in ('broadcast', 'confirmed')
+
+    def save_cursor(self, block_num):
+        """Record the next block to process."""
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO cursor (name, block_num, updated_at) VALUES ('last_block', ?, ?)",
+                                    (block_num, time.time()))
+
+    def load_cursor(self):
+        with self.lock:
+            row = self.connection.execute("SELECT block_num FROM cursor WHERE name = 'last_block'").fetchone()
+        return row[0] if row else None
+
+    def flush(self, save_remote):
+        """Upload the cursor with save_remote if it moved since the last upload, and prune old states."""
+        cursor = self.load_cursor()
+        self.last_flush = time.monotonic()
+        if cursor is not None and cursor != self.flushed_cursor:
+            save_remote(cursor)
+            self.flushed_cursor = cursor
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM comment_states WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    def maybe_flush(self, save_remote):
+        """Flush if CHECKPOINT_FLUSH_INTERVAL passed since the last flush."""
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush(save_remote)
+
+# Shared log used by main and the broadcaster
+checkpoint_log = CheckpointLog()
@@ -2,13 +2,14 @@ import os
 import sys
 from datetime import datetime, timedelta
 from beem import Hive
-from beem.account import Account
 from beem.comment import Comment
 from beem.exceptions import MissingKeyError
 from beemapi.exceptions import InvalidParameters
 import logging
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from hive_rpc import router, rpc_call
+from outbox import reply_pacer
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
@@ -40,18 +41,15 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 def get_latest_post(author):
     try:
-        hive = Hive(node='https://api.hive.blog')
-        account = Account(author, hive_instance=hive)
-        latest_post = None
-        for post in account.get_blog(limit=1):  # Limit to 1 to get the latest post
-            latest_post = post
-            logger.info(f"Retrieved post: {post}")
-            break
+        # Limit to 1 to get the latest post of the blog
+        params = {"sort": "blog", "account": author, "limit": 1}
+        posts = rpc_call("bridge.get_account_posts", params).get('result') or []
+        latest_post = posts[0] if posts else None
         if latest_post is None:
             logger.info(f"No posts found for account: {author}")
+        else:
+            logger.info(f"Retrieved post: @{latest_post['author']}/{latest_post['permlink']}")
         return latest_post
-    except MissingKeyError:
-        logger.error("Missing posting key. Please check your environment variables.")
     except Exception as e:
         logger.error(f"An error occurred while fetching the latest post: {e}")
         logger.debug(str(e))
@@ -64,17 +62,20 @@ def make_naive(dt):
     return dt
 
 def post_container_thread(parent_post, container_thread_text):
-    hive = Hive(node='https://api.hive.blog', keys=[POSTING_KEY])
+    """Post the container thread as a reply to parent_post and return whether it went through."""
+    hive = Hive(node=router.ranked(), keys=[POSTING_KEY])
     try:
         # Generate a unique permlink for your comment and convert it to lowercase
-        permlink = f"re-{parent_post.author}-{datetime.utcnow().strftime('%Y%m%dT%H')}"
+        permlink = f"re-{parent_post['author']}-{datetime.utcnow().strftime('%Y%m%dT%H')}"
         permlink = permlink.lower()
+        # The account shares one comment slot every few seconds with the replies
+        reply_pacer.wait()
         result = hive.post(
             title="",  # Leave empty for a comment
             body=container_thread_text,
             author=ACCOUNT,
             permlink=permlink,
-            reply_identifier=f"{parent_post.author}/{parent_post.permlink}",
+            reply_identifier=f"{parent_post['author']}/{parent_post['permlink']}",
             json_metadata={
                 "app": "leothreads/0.3",
                 "canonical_url": "https://inleo.io/threads/view/{permlink}",
@@ -88,11 +89,13 @@ def post_container_thread(parent_post, container_thread_text):
                 }  # Change this to have the same meta-patterns of other threadcasts "leothreads/0.3"
                 )
         logger.info(f"Container thread posted successfully: {result}")
+        return True
     except MissingKeyError:
         logger.error("Missing posting key. Please check your POSTING_KEY in the .env file.")
     except Exception as e:
         logger.error(f"An error occurred while posting the container thread: {e}")
         logger.debug(str(e))
+    return False
 
 def get_last_container_thread_post_time():
     try:
@@ -157,11 +160,14 @@ def container_thread_creator():
         logger.error("Failed to fetch the latest post by leothreads.")
         return
     
-    logger.info(f"Latest post by leothreads: {latest_post.permlink}")
+    logger.info(f"Latest post by leothreads: {latest_post['permlink']}")
     
     # Post a new container thread
     logger.info("Posting new container thread...")
-    post_container_thread(latest_post, CONTAINER_THREAD)
+    if not post_container_thread(latest_post, CONTAINER_THREAD):
+        # The last post time stays as it is, so the next maintenance run tries again
+        logger.error("Container thread was not posted.")
+        return
     
     # Update the last post time in Supabase
     update_last_container_thread_post_time()
@@ -1,12 +1,111 @@
+import os
 import json
-import re
 import logging
 import sys
+import threading
+from collections import deque
 
 # Setup logging for context_helper
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
 logger = logging.getLogger('context_helper')
 
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+class KeywordIndex:
+    """Aho-Corasick automaton over the keywords of the helper keywords file.
+
+    Every keyword maps straight to the entries that list it, so one linear pass
+    over the text finds all matching entries regardless of how many keywords exist.
+    Matching is case-insensitive and whole-word, like the regex it replaces
+    (word boundaries on both ends, so keywords may contain characters such as @ and #).
+    """
+
+    def __init__(self, keyword_items):
+        self.items = keyword_items
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [[]]  # Per state: (keyword, entry indexes) ending there
+        keyword_entries = {}
+        for index, item in enumerate(keyword_items):
+            for keyword in item['keywords']:
+                keyword_entries.setdefault(keyword.lower(), []).append(index)
+        for keyword, indexes in keyword_entries.items():
+            self._add(keyword, indexes)
+        self._link()
+
+    def _add(self, keyword, indexes):
+        state = 0
+        for char in keyword:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.transitions[state][char] = next_state
+            state = next_state
+        self.outputs[state].append((keyword, indexes))
+
+    def _link(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.transitions[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def search(self, text):
+        """Return the matched keywords and the sorted indexes of the entries they belong to."""
+        text = text.lower()
+        found_keywords = set()
+        found_entries = set()
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        state = 0
+        last = len(text) - 1
+        for position, char in enumerate(text):
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            if not outputs[state]:
+                continue
+            end_is_word = _is_word_char(char)
+            after_is_word = position < last and _is_word_char(text[position + 1])
+            if end_is_word == after_is_word:
+                continue
+            for keyword, indexes in outputs[state]:
+                start = position - len(keyword) + 1
+                before_is_word = start > 0 and _is_word_char(text[start - 1])
+                if before_is_word != _is_word_char(text[start]):
+                    found_keywords.add(keyword)
+                    found_entries.update(indexes)
+        return found_keywords, sorted(found_entries)
+
+# Indexes are built once per keywords file and rebuilt only when its mtime changes
+_keyword_indexes = {}
+_keyword_indexes_lock = threading.Lock()
+
+def get_keyword_index(keywords_file='helper_keywords.json'):
+    """Return the keyword index for a file, or None if the file does not exist."""
+    try:
+        mtime = os.stat(keywords_file).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _keyword_indexes_lock:
+        cached = _keyword_indexes.get(keywords_file)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(keywords_file, 'r') as file:
+            data = json.load(file)
+        index = KeywordIndex(data['keywords'])
+        _keyword_indexes[keywords_file] = (mtime, index)
+        logger.info(f"Loaded {len(data['keywords'])} keyword entries from {keywords_file}.")
+        return index
+
 def find_context_keywords(messages, keywords_file='helper_keywords.json'):
     """Find and prioritize context keywords in messages.
     
@@ -17,44 +116,34 @@ def find_context_keywords(messages, keywords_file='helper_keywords.json'):
     Returns:
         list: Prioritized context messages.
     """
-    # Load keywords from JSON file
-    try:
-        with open(keywords_file, 'r') as file:
-            data = json.load(file)
-            keywords = data['keywords']
-    except FileNotFoundError:
+    # Load the keyword index, rebuilt only when the file changed
+    keyword_index = get_keyword_index(keywords_file)
+    if keyword_index is None:
         logger.warning(f"File {keywords_file} not found. Treating it as an empty file without keywords.")
         return []
 
     # Prepare a dictionary to hold context messages by priority
     context_messages = {'HIGH': [], 'MID': [], 'LOW': []}
     seen_messages = set()
-    found_keywords = set()
 
     # Combine all messages into a single text for searching
     combined_messages = ' '.join(msg['content'] for msg in messages)
 
-    # Compile a regex pattern for case-insensitive, whole-word matching
-    # Allow special characters like @ and # in keywords
-    pattern = re.compile(r'\b(' + '|'.join(re.escape(keyword) for item in keywords for keyword in item['keywords']) + r')\b', re.IGNORECASE)
-
-    # Find matches
-    matches = pattern.findall(combined_messages)
+    # Find matches in a single pass
+    found_keywords, found_entries = keyword_index.search(combined_messages)
 
     # Log found keywords
-    for match in matches:
-        found_keywords.add(match.lower())
     if found_keywords:
         logger.info(f"Found keywords: {', '.join(found_keywords)}")
 
     # Add context messages based on matches
-    for keyword_item in keywords:
-        if any(keyword.lower() in found_keywords for keyword in keyword_item['keywords']):
-            message = keyword_item['message']
-            if message not in seen_messages:
-                print(message)
-                seen_messages.add(message)
-                context_messages[keyword_item['priority']].append({"role": get_role_from_priority(keyword_item['priority']), "content": message})
+    for entry_index in found_entries:
+        keyword_item = keyword_index.items[entry_index]
+        message = keyword_item['message']
+        if message not in seen_messages:
+            print(message)
+            seen_messages.add(message)
+            context_messages[keyword_item['priority']].append({"role": get_role_from_priority(keyword_item['priority']), "content": message})
 
     # Return the context messages, ordered by priority
     return context_messages['HIGH'] + context_messages['MID'] + context_messages['LOW']
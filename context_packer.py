@@ -0,0 +1,70 @@
+import os
+import sys
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+CHARS_PER_TOKEN = 4  # Rough average for English text, good enough for budgeting
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 24000))
+MAX_MESSAGE_TOKENS = int(os.getenv('MAX_MESSAGE_TOKENS', 4500))
+
+# Priority classes, lower classes are evicted first and the oldest message goes first within a class
+PRIORITY_LOW_CONTEXT = 0
+PRIORITY_LINK = 1
+PRIORITY_THREAD = 2
+PRIORITY_MID_CONTEXT = 3
+PRIORITY_USER = 4
+PRIORITY_SYSTEM = 5
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def message_priority(message, prompt_author):
+    """Classify a chain or context message for packing."""
+    role = message['role']
+    if role == 'system':
+        return PRIORITY_SYSTEM
+    if role == 'important_context':
+        return PRIORITY_MID_CONTEXT
+    if role == 'low_priority_context':
+        return PRIORITY_LOW_CONTEXT
+    if role == f"user_{prompt_author}":
+        return PRIORITY_USER
+    if role == 'user' and "\nLink's content:\n" in message['content']:
+        return PRIORITY_LINK
+    return PRIORITY_THREAD
+
+def pack_messages(messages, prompt_author, budget_tokens=CONTEXT_TOKEN_BUDGET, max_message_tokens=MAX_MESSAGE_TOKENS):
+    """Fit messages (in historical order, prompt last) into an approximate token budget.
+
+    Oversized messages are truncated to max_message_tokens first. Then messages are
+    evicted by priority class and age until the running total fits; the prompt itself
+    is always kept. The surviving messages keep their order.
+    """
+    max_chars = max_message_tokens * CHARS_PER_TOKEN
+    packed = []
+    total_tokens = 0
+    for message in messages:
+        if len(message['content']) > max_chars:
+            logger.info(f"Truncating a {message['role']} message of {len(message['content'])} characters to {max_chars}.")
+            message = dict(message, content=message['content'][:max_chars])
+        packed.append(message)
+        total_tokens += estimate_tokens(message['content'])
+    if total_tokens <= budget_tokens:
+        return packed
+
+    # The prompt is the last message and never evicted
+    candidates = sorted(range(len(packed) - 1), key=lambda index: (message_priority(packed[index], prompt_author), index))
+    evicted = set()
+    for index in candidates:
+        if total_tokens <= budget_tokens:
+            break
+        evicted.add(index)
+        total_tokens -= estimate_tokens(packed[index]['content'])
+        first_line = packed[index]['content'].split('\n', 1)[0][:80]
+        logger.info(f"Removed {packed[index]['role']} message: {first_line}")
+    logger.info(f"Packed {len(packed) - len(evicted)} of {len(packed)} messages into ~{total_tokens} tokens (budget {budget_tokens}).")
+    return [message for index, message in enumerate(packed) if index not in evicted]
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+CONVERSATION_DB = os.getenv('CONVERSATION_DB', 'conversations.sqlite3')
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', 3 * 24 * 3600))  # Threads idle for longer are evicted
+CONVERSATION_MAX_THREADS = int(os.getenv('CONVERSATION_MAX_THREADS', 2000))
+
+class ConversationStore:
+    """Local store of the context already assembled for comments the bot answered.
+
+    Entries are keyed by the answered comment ("author/permlink") and grouped by the
+    top of their chain, so a whole thread is evicted once it goes cold.
+    """
+
+    def __init__(self, path=CONVERSATION_DB, ttl=CONVERSATION_TTL, max_threads=CONVERSATION_MAX_THREADS):
+        self.ttl = ttl
+        self.max_threads = max_threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS conversations (
+                comment_id TEXT PRIMARY KEY,
+                root_id TEXT NOT NULL,
+                messages TEXT NOT NULL,
+                context TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS conversations_root ON conversations (root_id)")
+
+    def __contains__(self, comment_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM conversations WHERE comment_id = ? AND updated_at >= ?",
+                (comment_id, time.time() - self.ttl)).fetchone()
+        return row is not None
+
+    def load(self, comment_id):
+        """Return {'root_id', 'messages', 'context'} for an answered comment, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT root_id, messages, context FROM conversations WHERE comment_id = ? AND updated_at >= ?",
+                (comment_id, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return {'root_id': row[0], 'messages': json.loads(row[1]), 'context': json.loads(row[2])}
+
+    def save(self, comment_id, root_id, messages, context):
+        """Store the chain messages (newest first) and keyword context of an answered comment."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO conversations (comment_id, root_id, messages, context, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (comment_id, root_id, json.dumps(messages), json.dumps(context), time.time()))
+        self.evict()
+
+    def evict(self):
+        """Drop threads idle for longer than the TTL and the coldest ones beyond max_threads."""
+        with self.lock, self.connection:
+            expired = self.connection.execute(
+                "DELETE FROM conversations WHERE root_id IN "
+                "(SELECT root_id FROM conversations GROUP BY root_id HAVING MAX(updated_at) < ?)",
+                (time.time() - self.ttl,)).rowcount
+            overflow = self.connection.execute(
+                "DELETE FROM conversations WHERE root_id IN "
+                "(SELECT root_id FROM conversations GROUP BY root_id ORDER BY MAX(updated_at) DESC LIMIT -1 OFFSET ?)",
+                (self.max_threads,)).rowcount
+        if expired or overflow:
+            logger.info(f"Evicted {expired + overflow} stored conversation entries.")
+
+# Shared store used by the reply code
+conversation_store = ConversationStore()
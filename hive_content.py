@@ -0,0 +1,108 @@
+import os
+import sys
+import logging
+from hive_rpc import rpc_call
+from ttl_cache import TTLCache
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Comment bodies rarely change after the first minutes, edits seen in the block stream invalidate them
+CONTENT_CACHE_SIZE = int(os.getenv('CONTENT_CACHE_SIZE', 5000))
+CONTENT_CACHE_TTL = int(os.getenv('CONTENT_CACHE_TTL', 3600))
+content_cache = TTLCache(maxsize=CONTENT_CACHE_SIZE, ttl=CONTENT_CACHE_TTL)
+
+def _to_comment(post):
+    """Keep the fields the reply code reads from a condenser or bridge post."""
+    return {
+        'author': post.get('author', ''),
+        'permlink': post.get('permlink', ''),
+        'body': post.get('body', ''),
+        'parent_author': post.get('parent_author', ''),
+        'parent_permlink': post.get('parent_permlink', ''),
+        'root_author': post.get('root_author', ''),
+        'root_permlink': post.get('root_permlink', ''),
+        'depth': post.get('depth', 0)
+    }
+
+def invalidate_content(author, permlink):
+    """Forget a cached post, called whenever the block stream shows it being written."""
+    return content_cache.invalidate(f"{author}/{permlink}")
+
+def cache_content(post):
+    """Store a condenser or bridge post in the content cache and return its normalized form."""
+    comment = _to_comment(post)
+    content_cache.set(f"{comment['author']}/{comment['permlink']}", comment)
+    return comment
+
+def get_content(author, permlink, timeout=None):
+    """Fetch a single post or comment, returning None if it does not exist."""
+    cached = content_cache.get(f"{author}/{permlink}")
+    if cached is not None:
+        return cached
+    post = rpc_call("condenser_api.get_content", [author, permlink], timeout=timeout).get('result')
+    if not post or not post.get('author'):
+        return None
+    return cache_content(post)
+
+def get_discussion(author, permlink):
+    """Fetch a thread root with all of its replies in one call, keyed by "author/permlink".
+
+    Every post of the discussion is added to the content cache.
+    """
+    discussion = rpc_call("bridge.get_discussion", {"author": author, "permlink": permlink}).get('result') or {}
+    comments = {}
+    for key, post in discussion.items():
+        # Bridge posts do not carry their root, which is the post we asked for
+        post = dict(post, root_author=post.get('root_author') or author, root_permlink=post.get('root_permlink') or permlink)
+        comments[key] = cache_content(post)
+    return comments
+
+def get_ancestors(author, permlink, stop_authors=(), until=None):
+    """Return the comment at author/permlink followed by its ancestors up to the root.
+
+    The walk stops before any author in stop_authors. When the root belongs to such
+    an author (e.g. the leothreads container posts, which hold thousands of replies)
+    the chain is walked one get_content call per hop; otherwise the whole discussion
+    is fetched once and the chain is assembled locally. Cached hops need no call at all.
+    The walk also ends at the first comment whose "author/permlink" satisfies until;
+    that comment is returned as a stub holding only author and permlink, without a call.
+    """
+    chain = []
+    if not author or not permlink:
+        return chain
+    if author in stop_authors:
+        logger.info(f"Skipped blacklisted user: @{author}/{permlink}")
+        return chain
+    if until and until(f"{author}/{permlink}"):
+        return [{'author': author, 'permlink': permlink}]
+    try:
+        current = get_content(author, permlink)
+        if current is None:
+            logger.warning(f"Comment @{author}/{permlink} not found. Stopping chain trace.")
+            return chain
+        discussion = None
+        while current:
+            chain.append(current)
+            parent_author = current['parent_author']
+            parent_permlink = current['parent_permlink']
+            if not parent_author or not parent_permlink:
+                break
+            if parent_author in stop_authors:
+                logger.info(f"Skipped blacklisted user: @{parent_author}/{parent_permlink}")
+                break
+            parent_id = f"{parent_author}/{parent_permlink}"
+            if until and until(parent_id):
+                chain.append({'author': parent_author, 'permlink': parent_permlink})
+                break
+            current = content_cache.get(parent_id)
+            if current is None and discussion is None:
+                root = chain[0]
+                discussion = {}
+                if root['depth'] > 1 and root['root_author'] and root['root_author'] not in stop_authors:
+                    discussion = get_discussion(root['root_author'], root['root_permlink'])
+            current = current or discussion.get(parent_id) or get_content(parent_author, parent_permlink)
+    except Exception as e:
+        logger.error(f"Error fetching ancestors of @{author}/{permlink}: {e}")
+    return chain
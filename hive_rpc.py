@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from resilience import TransientError, get_breaker
+from metrics import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Load environment variables
+load_dotenv()
+
+# Constants
+DEFAULT_HIVE_API_NODES = 'https://api.hive.blog,https://api.deathwing.me,https://api.openhive.network'
+HIVE_API_NODES = [node.strip() for node in os.getenv('HIVE_API_NODES', DEFAULT_HIVE_API_NODES).split(',') if node.strip()]
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', 30))  # Default timeout in seconds for every JSON-RPC call
+RPC_POOL_SIZE = int(os.getenv('RPC_POOL_SIZE', 10))  # Keep-alive connections kept open per node
+LATENCY_WINDOW = 50  # Recent calls per node used for latency and error scores
+NODE_COOLDOWN = float(os.getenv('NODE_COOLDOWN', 30))  # Seconds a node with an open circuit sits out before a trial call
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.9))  # Latency percentile after which a hedge is fired
+HEDGE_DEFAULT_DELAY = 1.0  # Hedge delay in seconds until a node has enough samples
+
+# One pooled session per node, shared by every module and thread
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(node):
+    """Return the keep-alive session for a Hive API node, creating it on first use."""
+    with _sessions_lock:
+        session = _sessions.get(node)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({
+                'Content-Type': 'application/json',
+                'Accept-Encoding': 'gzip, deflate'
+            })
+            _sessions[node] = session
+        return session
+
+def rpc_request(node, method, params, timeout=None, raw=False):
+    """Send one JSON-RPC call to a node and return the decoded response.
+
+    With raw the undecoded body bytes are returned instead. Raises
+    requests.RequestException on connection errors, timeouts, HTTP errors
+    and undecodable bodies, so callers can keep their existing except clauses.
+    """
+    payload = {
+        "jsonrpc": "2.0",
+        "method": method,
+        "params": params,
+        "id": 1
+    }
+    metrics.inc('hive_rpc_requests_total', method=method)
+    response = get_session(node).post(node, json=payload, timeout=timeout or RPC_TIMEOUT)
+    response.raise_for_status()
+    return response.content if raw else response.json()
+
+class NodeResponseError(TransientError):
+    """Raised when a node answers but the response is unusable (error or empty result)."""
+
+class NodeRouter:
+    """Send JSON-RPC calls to the fastest healthy Hive node.
+
+    Every call records its latency and outcome. Nodes are ranked by their median
+    latency, penalized by their recent error rate, and a node whose circuit
+    breaker opened (a dead or flapping node) sits out until its trial call. Hedged calls fire a duplicate request at the second
+    best node once the first one is slower than its usual HEDGE_PERCENTILE latency,
+    and return whichever valid answer arrives first.
+    """
+
+    def __init__(self, nodes=HIVE_API_NODES):
+        self.nodes = list(nodes)
+        self.latencies = {node: deque(maxlen=LATENCY_WINDOW) for node in self.nodes}
+        self.outcomes = {node: deque(maxlen=LATENCY_WINDOW) for node in self.nodes}
+        self.breakers = {node: get_breaker(node, reset=NODE_COOLDOWN) for node in self.nodes}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.nodes), thread_name_prefix='hedge')
+
+    def _score(self, node, now):
+        latencies = sorted(self.latencies[node])
+        outcomes = self.outcomes[node]
+        # Unmeasured nodes score best so that they get tried
+        median = latencies[len(latencies) // 2] if latencies else (HEDGE_DEFAULT_DELAY if outcomes else 0.0)
+        error_rate = outcomes.count(False) / len(outcomes) if outcomes else 0.0
+        return (self.breakers[node].is_open(), median * (1 + 4 * error_rate))
+
+    def ranked(self):
+        """Return the nodes ordered from best to worst."""
+        now = time.monotonic()
+        with self.lock:
+            return sorted(self.nodes, key=lambda node: self._score(node, now))
+
+    def best_node(self):
+        return self.ranked()[0]
+
+    def record(self, node, latency, ok):
+        with self.lock:
+            self.outcomes[node].append(ok)
+            if ok:
+                self.latencies[node].append(latency)
+        self.breakers[node].record(ok)
+        metrics.observe('hive_rpc_seconds', latency, node=node)
+        if not ok:
+            metrics.inc('hive_rpc_errors_total', node=node)
+
+    def hedge_delay(self, node):
+        with self.lock:
+            latencies = sorted(self.latencies[node])
+        if len(latencies) < 5:
+            return HEDGE_DEFAULT_DELAY
+        return latencies[min(int(len(latencies) * HEDGE_PERCENTILE), len(latencies) - 1)]
+
+    def call_node(self, node, method, params, timeout=None, validate=None, raw=False):
+        """Call a specific node, record the outcome and return the decoded (or raw) response.
+
+        Raw responses are not decoded, so only validate can reject them.
+        """
+        start = time.monotonic()
+        try:
+            response = rpc_request(node, method, params, timeout=timeout, raw=raw)
+            if raw:
+                if validate and not validate(response):
+                    raise NodeResponseError(f"Unusable response from {node} for {method}: {response[:200]!r}")
+            elif 'error' in response or (validate and not validate(response)):
+                raise NodeResponseError(f"Unusable response from {node} for {method}: {str(response.get('error'))[:200]}")
+        except Exception as e:
+            self.record(node, time.monotonic() - start, False)
+            logger.warning(f"{method} failed on {node}: {e}")
+            raise
+        self.record(node, time.monotonic() - start, True)
+        return response
+
+    def call(self, method, params, timeout=None, hedge=False, validate=None, raw=False):
+        """Call the best node, optionally hedging with the runner-up.
+
+        validate is an optional predicate on the decoded response (the body bytes
+        with raw); a response that fails it counts as a node error.
+        """
+        ranked = self.ranked()
+        if not hedge or len(ranked) < 2:
+            return self.call_node(ranked[0], method, params, timeout, validate, raw)
+
+        primary, secondary = ranked[0], ranked[1]
+        pending = {self.executor.submit(self.call_node, primary, method, params, timeout, validate, raw)}
+        done, _ = wait(pending, timeout=self.hedge_delay(primary))
+        hedged = False
+        last_error = None
+        while True:
+            for future in done:
+                pending.discard(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+            if not hedged:
+                # The primary is slow or failed, race it against the runner-up
+                hedged = True
+                pending.add(self.executor.submit(self.call_node, secondary, method, params, timeout, validate, raw))
+            if not pending:
+                raise last_error
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+# Shared router used by every module
+router = NodeRouter()
+
+def rpc_call(method, params, timeout=None, hedge=False, validate=None, raw=False):
+    """Send a JSON-RPC call through the shared node router."""
+    return router.call(method, params, timeout=timeout, hedge=hedge, validate=validate, raw=raw)
@@ -2,13 +2,16 @@
 import os
 import logging
 import requests
-import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from beem import Hive
-from beem.account import Account
 from beem.exceptions import MissingKeyError
 from supabase import create_client
+from hive_rpc import router, rpc_call
+from supabase_writer import WriteBuffer
+from outbox import Outbox
+from resilience import retry_call, get_breaker
+from metrics import metrics
 
 # Load environment variables
 load_dotenv()
@@ -18,8 +21,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Constants with default values
-DEFAULT_API_NODE = 'https://api.hive.blog'
-HIVE_API_NODES = os.getenv('HIVE_API_NODES', DEFAULT_API_NODE).split(',')
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 CREATOR_SUB_ACC = os.getenv('CREATOR_SUB_ACC')
@@ -30,50 +31,114 @@ MIN_HBD = float(os.getenv('MIN_HBD', 0.20))
 MIN_HIVE = float(os.getenv('MIN_HIVE', 0.50))
 MAX_HBD = 30 * MIN_HBD
 MAX_HIVE = 30 * MIN_HIVE
+SUBSCRIPTION_PAYMENT_ACCOUNT = 'leosubscriptions'
+SUBSCRIPTION_DAYS = 31  # A leosubscriptions payment is valid for 31 days
+BUYER_GRACE = timedelta(days=1)  # Buyers keep access for a day after their end date
+HISTORY_PAGE_SIZE = 1000  # Largest page condenser_api.get_account_history returns
+HISTORY_MAX_PAGES = int(os.getenv('HISTORY_MAX_PAGES', 20))  # Pages read back per account and refresh
+HISTORY_DEADLINE = float(os.getenv('HISTORY_DEADLINE', 30))  # Seconds all attempts to read one history page may take
+
+# Expiry times (naive UTC, None for no expiry) of the users seen by the last refresh
+subscriber_expiries = {}
+freetrial_expiries = {}
+buyer_expiries = {}
 
 # Initialize Supabase client
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# A failing Supabase is skipped for a while instead of being retried on every row
+supabase_breaker = get_breaker('supabase')
+# Row writes are grouped into bulk upserts and deletes per table
+write_buffer = WriteBuffer(supabase)
 
-# Initialize Hive client with active key
-hive = Hive(node=HIVE_API_NODES[0], keys=[ACTIVE_KEY])
-account = Account(ACCOUNT, blockchain_instance=hive)
+# Initialize Hive client with the active key for transfers and the posting key for notifications
+hive = Hive(node=router.ranked(), keys=[ACTIVE_KEY, POSTING_KEY])
+# Transfers and notification comments of a refresh go out together when add_buyers finishes
+outbox = Outbox(hive, ACCOUNT)
 
 # Messages that can be easily edited
 SUBSCRIPTION_ADD_MESSAGE = "Thank you @{} for subscribing to `llamathreads`. Your subscription starts at {} and ends at {}!"
 SUBSCRIPTION_REMOVE_MESSAGE = "Your subscription to `llamathreads` has ended. Thanks for the conversations! Feel free to subscribe again. [Usage Instructions](https://inleo.io/threads/view/llamathreads/re-leothreads-2tychfjaq?referral=llamathreads)"
 
-# Function to check if API node is valid
-def is_valid_api_node(api_node):
+# Function to parse a Supabase timestamp into a naive UTC datetime
+def parse_utc(value):
+    if not value:
+        return None
     try:
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "condenser_api.get_account_count",
-            "params": [],
-            "id": 1
-        }
-        response = requests.post(api_node, json=payload, timeout=5)
-        response.raise_for_status()
-        return True
-    except requests.RequestException as e:
-        logger.warning(f'API node {api_node} is not responsive: {e}')
-        return False
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        logger.warning(f"Could not parse timestamp {value}")
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 # Function to fetch account history
 def fetch_account_history(account_name, start=-1, limit=1000):
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "condenser_api.get_account_history",
-        "params": [account_name, start, limit],
-        "id": 1
-    }
     try:
-        response = requests.post(HIVE_API_NODES[0], json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        logger.error(f'Error fetching account history from {HIVE_API_NODES[0]}: {e}')
+        return retry_call(lambda: rpc_call("condenser_api.get_account_history", [account_name, start, limit]),
+                          f"Fetching account history of {account_name}", attempts=4, deadline=HISTORY_DEADLINE)
+    except Exception as e:
+        logger.error(f'Error fetching account history for {account_name}: {e}')
         return None
 
+# Function to fetch the operations of an account above a history cursor, oldest first
+def fetch_new_operations(account_name, cursor):
+    operations = []
+    start = -1
+    for _ in range(HISTORY_MAX_PAGES):
+        limit = HISTORY_PAGE_SIZE if start < 0 else min(HISTORY_PAGE_SIZE, start + 1)
+        data = fetch_account_history(account_name, start, limit)
+        if data is None or 'result' not in data:
+            return None
+        page = [operation for operation in data['result'] if operation[0] > cursor]
+        operations = page + operations
+        # Stop once the page reaches the cursor or the start of the history
+        if not page or len(page) < len(data['result']) or page[0][0] == 0:
+            return operations
+        start = page[0][0] - 1
+    logger.warning(f'History cursor of {account_name} is more than {HISTORY_MAX_PAGES} pages behind. Older operations are skipped.')
+    return operations
+
+# Function to fetch the operations of an account since a point in time, oldest first
+def fetch_operations_since(account_name, since):
+    operations = []
+    start = -1
+    for _ in range(HISTORY_MAX_PAGES):
+        limit = HISTORY_PAGE_SIZE if start < 0 else min(HISTORY_PAGE_SIZE, start + 1)
+        data = fetch_account_history(account_name, start, limit)
+        if data is None or 'result' not in data:
+            return None if not operations else operations
+        operations = data['result'] + operations
+        if not data['result'] or data['result'][0][0] == 0:
+            break
+        oldest_transaction_time = datetime.strptime(data['result'][0][1]['timestamp'], '%Y-%m-%dT%H:%M:%S')
+        if oldest_transaction_time < since:
+            break
+        start = data['result'][0][0] - 1
+    return operations
+
+# Function to load the last processed history operation index of an account
+def load_history_cursor(account_name):
+    try:
+        with metrics.timed('supabase', operation='load_history_cursor'):
+            response = retry_call(lambda: supabase.table('llamathreads_data').select('value').eq('_id', f'history_cursor:{account_name}').execute(),
+                                  f"Loading the history cursor of {account_name}", attempts=3, breaker=supabase_breaker)
+        if response.data:
+            return int(response.data[0]['value'])
+    except Exception as e:
+        logger.error(f'Error loading history cursor for {account_name}: {e}')
+    return None
+
+# Function to save the last processed history operation index of an account
+def save_history_cursor(account_name, index):
+    try:
+        with metrics.timed('supabase', operation='save_history_cursor'):
+            retry_call(lambda: supabase.table('llamathreads_data').upsert({'_id': f'history_cursor:{account_name}', 'value': str(index)}).execute(),
+                       f"Saving the history cursor of {account_name}", attempts=3, breaker=supabase_breaker)
+        logger.info(f'Saved history cursor for {account_name}: {index}')
+    except Exception as e:
+        logger.error(f'Error saving history cursor for {account_name}: {e}')
+
 # Function to process and filter transfers
 def process_transfers(data, subscription_payment_account, creator_sub_acc):
     if data is None or 'result' not in data:
@@ -106,152 +171,181 @@ def process_transfers(data, subscription_payment_account, creator_sub_acc):
 
 # Function to update subscribers in Supabase
 def update_subscribers(valid_transfers, current_time, thirty_one_days_ago):
-    # Delete old subscribers
-    supabase.table('subscribers').delete().lt('timestamp', thirty_one_days_ago.isoformat()).execute()
-    # Update or insert new subscribers
+    # Delete old subscribers, a returning one is inserted again below
+    expired = supabase.table('subscribers').delete().lt('timestamp', thirty_one_days_ago.isoformat()).execute().data or []
+    subscribers_set.difference_update(subscriber['username'] for subscriber in expired)
+    # Update or insert new subscribers, the latest transfer of a user wins within a batch.
+    # subscribers.username has no unique constraint to upsert on, so known users are updated
+    # and new ones inserted, each in bulk.
     for transfer in valid_transfers:
         subscriber_data = {
             'username': transfer['username'],
             'timestamp': transfer['timestamp'].isoformat()
         }
-        # Check if the username already exists
         if transfer['username'] in subscribers_set:
-            # If the username exists, update the timestamp
-            supabase.table('subscribers').update({'timestamp': transfer['timestamp'].isoformat()}).eq('username', transfer['username']).execute()
+            write_buffer.update('subscribers', subscriber_data, key='username')
         else:
-            # Otherwise, insert the new subscriber
-            supabase.table('subscribers').insert(subscriber_data).execute()
+            write_buffer.insert('subscribers', subscriber_data, key='username')
             subscribers_set.add(transfer['username'])
 
 # Function to get the list of subscribers
 def subscribers_list(subscription_payment_account, creator_sub_acc):
-    global HIVE_API_NODES, subscribers_set, freetrial_set
-    if not is_valid_api_node(HIVE_API_NODES[0]):
-        logger.warning(f'Using default API node {DEFAULT_API_NODE} as {HIVE_API_NODES[0]} is not responsive.')
-        HIVE_API_NODES = [DEFAULT_API_NODE]
-    
+    global subscribers_set, freetrial_set, subscriber_expiries, freetrial_expiries
     # Fetch all subscribers and freetrial data
-    subscribers_data = supabase.table('subscribers').select('*').execute().data
-    freetrial_data = supabase.table('freetrial').select('*').execute().data
+    with metrics.timed('supabase', operation='select_subscribers'):
+        subscribers_data = supabase.table('subscribers').select('*').execute().data
+        freetrial_data = supabase.table('freetrial').select('*').execute().data
     
     # Create sets for quick lookup
     subscribers_set = {subscriber['username'] for subscriber in subscribers_data}
     freetrial_set = {free_trial['username'] for free_trial in freetrial_data}
     
-    data = fetch_account_history(subscription_payment_account)
+    # Only operations above the cursor are parsed; the first run reads the latest page
+    cursor = load_history_cursor(subscription_payment_account)
+    if cursor is None:
+        data = fetch_account_history(subscription_payment_account)
+    else:
+        operations = fetch_new_operations(subscription_payment_account, cursor)
+        data = None if operations is None else {'result': operations}
     valid_transfers, invalid_transfers = process_transfers(data, subscription_payment_account, creator_sub_acc)
     current_time = datetime.utcnow()
     thirty_one_days_ago = current_time - timedelta(days=31)
     update_subscribers(valid_transfers, current_time, thirty_one_days_ago)
+    # The cursor only moves once the subscribers behind it are written
+    write_buffer.flush()
+    if data and data.get('result'):
+        save_history_cursor(subscription_payment_account, data['result'][-1][0])
     
     for invalid_transfer in invalid_transfers:
         logger.info(f"Invalid subscription for user {invalid_transfer['username']} - Off by {invalid_transfer['days_off']} days")
     
+    # Record when every subscription runs out, the latest payment wins
+    subscriber_expiries = {}
+    for subscriber in subscribers_data:
+        started = parse_utc(subscriber.get('timestamp'))
+        subscriber_expiries[subscriber['username']] = started + timedelta(days=SUBSCRIPTION_DAYS) if started else None
+    for transfer in valid_transfers:
+        expiry = transfer['timestamp'] + timedelta(days=SUBSCRIPTION_DAYS)
+        previous = subscriber_expiries.get(transfer['username'])
+        subscriber_expiries[transfer['username']] = max(expiry, previous) if previous else expiry
+    freetrial_expiries = {free_trial['username']: parse_utc(free_trial.get('end_date')) for free_trial in freetrial_data}
+    
     all_users = list(subscribers_set | freetrial_set)
     logger.info(f'Total users with valid subscriptions or free trial: {len(all_users)}')
     return all_users
 
-# Function to fetch all processed transfers from Supabase
-def fetch_processed_transfers():
-    try:
-        response = supabase.table('processed_transfers').select('*').execute()
-        processed_txs = {tx['tx_id'] for tx in response.data}
-        return processed_txs
-    except Exception as e:
-        logger.error(f'Error fetching processed transfers from Supabase: {e}')
+# Function to fetch which of the given transfers were already processed
+def fetch_processed_transfers(tx_ids):
+    # Errors are raised, an unknown answer must not let a transfer be refunded or confirmed twice
+    if not tx_ids:
         return set()
+    with metrics.timed('supabase', operation='select_processed_transfers'):
+        response = retry_call(lambda: supabase.table('processed_transfers').select('tx_id').in_('tx_id', list(tx_ids)).execute(),
+                              "Fetching processed transfers", attempts=3, breaker=supabase_breaker)
+    return {tx['tx_id'] for tx in response.data}
 
 # Function to add buyers
 def add_buyers():
+    global buyer_expiries
     current_time = datetime.utcnow()
     one_day_ago = current_time - timedelta(days=1)
     twenty_four_hours_ago = current_time - timedelta(hours=24)
-    limit = 1000
-    start = -1
     valid_buyers = []
-    
-    # Fetch all processed transfers at the start
-    processed_txs = fetch_processed_transfers()
+    processed_rows = []
     
     # Fetch all buyers data
-    buyers_data = supabase.table('buyers').select('*').execute().data
+    with metrics.timed('supabase', operation='select_buyers'):
+        buyers_data = supabase.table('buyers').select('*').execute().data
     buyers_set = {buyer['username']: buyer for buyer in buyers_data}
     
     # Delete old processed transfers
     supabase.table('processed_transfers').delete().lt('timestamp', twenty_four_hours_ago.isoformat()).execute()
     
-    while True:
-        data = fetch_account_history(ACCOUNT, start, limit)
-        if data is None or 'result' not in data:
-            logger.error('Unexpected API response format')
-            break
-        for operation in data['result']:
-            op_details = operation[1]
-            if op_details['op'][0] == 'transfer':
-                transfer = op_details['op'][1]
-                transfer_time = datetime.strptime(op_details['timestamp'], '%Y-%m-%dT%H:%M:%S')
-                if transfer_time < twenty_four_hours_ago:
-                    # If the transfer is older than 24 hours, skip it
-                    continue
-                amount_value = float(transfer['amount'].split()[0])
-                amount_currency = transfer['amount'].split()[1]
-                tx_id = op_details['trx_id']
-                if tx_id in processed_txs:
-                    logger.info(f"Transfer {tx_id} already processed. Skipping.")
+    cursor = load_history_cursor(ACCOUNT)
+    if cursor is None:
+        # Without a cursor scan the last 24 hours
+        operations = fetch_operations_since(ACCOUNT, twenty_four_hours_ago)
+    else:
+        operations = fetch_new_operations(ACCOUNT, cursor)
+    if operations is None:
+        logger.error('Unexpected API response format')
+        operations = []
+    # The cursor save can fail after a refresh, so new operations are still checked against processed transfers
+    processed_txs = fetch_processed_transfers({operation[1]['trx_id'] for operation in operations if operation[1]['op'][0] == 'transfer'})
+    for operation in operations:
+        op_details = operation[1]
+        if op_details['op'][0] == 'transfer':
+            transfer = op_details['op'][1]
+            transfer_time = datetime.strptime(op_details['timestamp'], '%Y-%m-%dT%H:%M:%S')
+            if cursor is None and transfer_time < twenty_four_hours_ago:
+                # If the transfer is older than 24 hours, skip it
+                continue
+            amount_value = float(transfer['amount'].split()[0])
+            amount_currency = transfer['amount'].split()[1]
+            tx_id = op_details['trx_id']
+            if tx_id in processed_txs:
+                logger.info(f"Transfer {tx_id} already processed. Skipping.")
+                continue
+            if transfer['to'] == ACCOUNT:
+                if amount_currency == 'HBD':
+                    days = calculate_days(amount_value, MIN_HBD, MAX_HBD)
+                elif amount_currency == 'HIVE':
+                    days = calculate_days(amount_value, MIN_HIVE, MAX_HIVE)
+                else:
+                    logger.error(f"Unsupported currency: {amount_currency}")
                     continue
-                if transfer['to'] == ACCOUNT:
-                    if amount_currency == 'HBD':
-                        days = calculate_days(amount_value, MIN_HBD, MAX_HBD)
-                    elif amount_currency == 'HIVE':
-                        days = calculate_days(amount_value, MIN_HIVE, MAX_HIVE)
-                    else:
-                        logger.error(f"Unsupported currency: {amount_currency}")
-                        continue
-                    if days == 0:
-                        send_transfer(transfer['from'], amount_value, amount_currency, f"Returning {transfer['amount']} as it is not within the acceptable threshold.")
+                if days == 0:
+                    send_transfer(transfer['from'], amount_value, amount_currency, f"Returning {transfer['amount']} as it is not within the acceptable threshold.")
+                    processed_rows.append({
+                        'tx_id': tx_id,
+                        'timestamp': transfer_time.isoformat()
+                    })
+                else:
+                    # Check if the user is already a buyer with an active subscription
+                    existing_buyer = buyers_set.get(transfer['from'])
+                    if existing_buyer and datetime.fromisoformat(existing_buyer['end_date']) > current_time:
+                        # If the user already has an active subscription, refund them
+                        send_transfer(transfer['from'], amount_value, amount_currency, f"Returning {transfer['amount']} as your subscription is still active until {existing_buyer['end_date']}.")
+                        processed_rows.append({
+                            'tx_id': tx_id,
+                            'timestamp': transfer_time.isoformat()
+                        })
                     else:
-                        # Check if the user is already a buyer with an active subscription
-                        existing_buyer = buyers_set.get(transfer['from'])
-                        if existing_buyer and datetime.fromisoformat(existing_buyer['end_date']) > current_time:
-                            # If the user already has an active subscription, refund them
-                            send_transfer(transfer['from'], amount_value, amount_currency, f"Returning {transfer['amount']} as your subscription is still active until {existing_buyer['end_date']}.")
-                            supabase.table('processed_transfers').insert({
-                                'tx_id': tx_id,
-                                'timestamp': transfer_time.isoformat()
-                            }).execute()
-                        else:
-                            new_end_date = transfer_time + timedelta(days=days)
-                            valid_buyers.append({
-                                'username': transfer['from'],
-                                'start_date': transfer_time.isoformat(),
-                                'end_date': new_end_date.isoformat()
-                            })
-                            send_transfer(transfer['from'], 0.001, 'HIVE', f"Congrats! You're now subscribed for {days} day(s) to {ACCOUNT}'s services!")
-                            notify_user_on_subscription_change(transfer['from'], transfer_time, new_end_date, True)
-                            supabase.table('processed_transfers').insert({
-                                'tx_id': tx_id,
-                                'timestamp': transfer_time.isoformat()
-                            }).execute()
-                            buyers_set[transfer['from']] = {
-                                'username': transfer['from'],
-                                'start_date': transfer_time.isoformat(),
-                                'end_date': new_end_date.isoformat()
-                            }
-        if data['result']:
-            oldest_transaction_time = datetime.strptime(data['result'][0][1]['timestamp'], '%Y-%m-%dT%H:%M:%S')
-            if oldest_transaction_time >= twenty_four_hours_ago:
-                start = data['result'][0][0]
-                continue
-        break
+                        new_end_date = transfer_time + timedelta(days=days)
+                        valid_buyers.append({
+                            'username': transfer['from'],
+                            'start_date': transfer_time.isoformat(),
+                            'end_date': new_end_date.isoformat()
+                        })
+                        send_transfer(transfer['from'], 0.001, 'HIVE', f"Congrats! You're now subscribed for {days} day(s) to {ACCOUNT}'s services!")
+                        notify_user_on_subscription_change(transfer['from'], transfer_time, new_end_date, True)
+                        processed_rows.append({
+                            'tx_id': tx_id,
+                            'timestamp': transfer_time.isoformat()
+                        })
+                        buyers_set[transfer['from']] = {
+                            'username': transfer['from'],
+                            'start_date': transfer_time.isoformat(),
+                            'end_date': new_end_date.isoformat()
+                        }
     
     # Handle old buyers
     old_buyers = [buyer for buyer in buyers_set.values() if datetime.fromisoformat(buyer['end_date']) < one_day_ago]
     for old_buyer in old_buyers:
         send_transfer(old_buyer['username'], 0.001, 'HIVE', f"Your subscription to `{ACCOUNT}` has ended. Thanks for using it!")
         notify_user_on_subscription_change(old_buyer['username'], old_buyer['start_date'], old_buyer['end_date'], False)
-        supabase.table('buyers').delete().eq('username', old_buyer['username']).execute()
         buyers_set.pop(old_buyer['username'], None)
     
+    # Refunds, confirmations and expiry notices of this refresh go out in one broadcast.
+    # Nothing is written before it, so an aborted refresh leaves no transfer marked processed
+    # whose refund or confirmation was never sent.
+    flush_outbox()
+    
+    for row in processed_rows:
+        write_buffer.upsert('processed_transfers', row, key='tx_id')
+    for old_buyer in old_buyers:
+        write_buffer.delete('buyers', 'username', old_buyer['username'])
+    
     # Upsert new buyers
     for buyer in valid_buyers:
         buyer_data = {
@@ -259,8 +353,17 @@ def add_buyers():
             'start_date': buyer['start_date'],
             'end_date': buyer['end_date']
         }
-        supabase.table('buyers').upsert(buyer_data).execute()
+        write_buffer.upsert('buyers', buyer_data, key='username')
         buyers_set[buyer['username']] = buyer
+    # The cursor only moves once the processed transfers behind it are written
+    write_buffer.flush()
+    if operations:
+        save_history_cursor(ACCOUNT, operations[-1][0])
+    
+    buyer_expiries = {}
+    for buyer in buyers_set.values():
+        end_date = parse_utc(buyer['end_date'])
+        buyer_expiries[buyer['username']] = end_date + BUYER_GRACE if end_date else None
     
     active_buyers = [buyer['username'] for buyer in buyers_set.values()]
     logger.info(f'Total active buyers: {len(active_buyers)}')
@@ -275,34 +378,37 @@ def calculate_days(amount, min_amount, max_amount):
     else:
         return int(amount / min_amount)
 
-# Function to send a transfer
+# Function to queue a transfer in the outbox
 def send_transfer(to_account, amount, asset, memo):
     try:
-        logger.info(f"Attempting to transfer {amount} {asset} to {to_account} with memo: {memo}")
-        account.transfer(to_account, amount, asset, memo)
-        logger.info(f"Transfer of {amount} {asset} to {to_account} successful with memo: {memo}")
-        time.sleep(3)
+        outbox.transfer(to_account, amount, asset, memo)
+        logger.info(f"Queued transfer of {amount} {asset} to {to_account} with memo: {memo}")
     except Exception as e:
-        logger.error(f"Error sending transfer of {amount} {asset} to {to_account} with memo: {memo}. Error: {e}")
+        logger.error(f"Error queueing transfer of {amount} {asset} to {to_account} with memo: {memo}. Error: {e}")
+
+# Function to broadcast the queued transfers and notifications
+def flush_outbox():
+    try:
+        results = outbox.flush()
+    except MissingKeyError:
+        logger.error("Missing active or posting key. Please check your ACTIVE_KEY and POSTING_KEY in the .env file.")
+        return []
+    for result in results:
+        if not result['ok']:
+            logger.error(f"Failed to broadcast {result['operation']}: {result['error']}")
+    return results
 
 # Function to get the latest author comment
 def get_latest_author_comment(username):
-    url = HIVE_API_NODES[0]
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "account_history_api.get_account_history",
-        "params": {
-            "account": username,
-            "start": -1,
-            "limit": 1000,  # Adjust limit as needed
-            "operation_filter_low": 2  # 2 means a comment operation
-        },
-        "id": 1
+    params = {
+        "account": username,
+        "start": -1,
+        "limit": 1000,  # Adjust limit as needed
+        "operation_filter_low": 2  # 2 means a comment operation
     }
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        response_json = response.json()
+        response_json = retry_call(lambda: rpc_call("account_history_api.get_account_history", params),
+                                   f"Fetching the comments of {username}", attempts=3, deadline=HISTORY_DEADLINE)
         history = response_json.get('result', {}).get('history', [])
         # Reverse the history to find the latest comment where the user is the author
         for operation in reversed(history):
@@ -343,16 +449,14 @@ def notify_user_on_subscription_change(username, start_date, end_date, is_additi
             # Generate a unique permlink for your comment and convert it to lowercase
             permlink = f"re-{parent_comment['author']}-{parent_comment['permlink']}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}"
             permlink = permlink.lower()
-            hive = Hive(node=HIVE_API_NODES[0], keys=[POSTING_KEY])
-            result = hive.post(
-                title="",  # Leave empty for a comment
-                body=reply_text,
-                author=ACCOUNT,
-                permlink=permlink,
-                reply_identifier=f"{parent_comment['author']}/{parent_comment['permlink']}",
+            outbox.comment(
+                parent_comment['author'],
+                parent_comment['permlink'],
+                permlink,
+                reply_text,
                 json_metadata={"app": "leothreads/0.3"}  # Use Leothreads interface for posting to the blockchain
             )
-            logger.info(f"Notification sent to {username} regarding subscription change with reply text: {reply_text}")
+            logger.info(f"Notification queued for {username} regarding subscription change with reply text: {reply_text}")
         else:
             logger.info(f"No author comment found for {username}. No comment notification sent.")
     except MissingKeyError:
@@ -361,20 +465,21 @@ def notify_user_on_subscription_change(username, start_date, end_date, is_additi
         logger.error(f"An error occurred while notifying user {username} of subscription change: {e}")
         logger.debug(str(e))
 
-# Function to switch Hive API node
-def switch_hive_node():
-    global HIVE_API_NODES
-    current_index = HIVE_API_NODES.index(HIVE_API_NODES[0])
-    next_index = (current_index + 1) % len(HIVE_API_NODES)
-    HIVE_API_NODES[0] = HIVE_API_NODES[next_index]
-    hive.set_nodes([HIVE_API_NODES[0]])
-    logger.info(f"Switched to new API node: {HIVE_API_NODES[0]}")
-
-# Example usage
-def list_all_users():
-    SUBSCRIPTION_PAYMENT_ACCOUNT = 'leosubscriptions'
-    subscribers = subscribers_list(SUBSCRIPTION_PAYMENT_ACCOUNT, CREATOR_SUB_ACC)
-    buyers = add_buyers()
-    all_users = list(set(subscribers + buyers))
-    print(all_users)
-    return all_users
+# Function to refresh all subscriptions with their expiry times
+def list_all_subscriptions():
+    """Return {'subscribers', 'freetrial', 'buyers'} dicts mapping username to expiry (naive UTC or None)."""
+    try:
+        subscribers_list(SUBSCRIPTION_PAYMENT_ACCOUNT, CREATOR_SUB_ACC)
+        add_buyers()
+    except Exception:
+        # add_buyers writes nothing before its broadcast, so anything still queued belongs to
+        # operations the next refresh processes and queues again; they must not go out twice
+        dropped = outbox.clear()
+        if dropped:
+            logger.warning(f"Refresh aborted, dropped {dropped} queued operations.")
+        raise
+    return {
+        'subscribers': dict(subscriber_expiries),
+        'freetrial': dict(freetrial_expiries),
+        'buyers': dict(buyer_expiries)
+    }
@@ -1,12 +1,22 @@
-import requests
 import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
 import re
+import json
 from beem import Hive
 from beem.comment import Comment
 from beem.exceptions import ContentDoesNotExistsException
 from supabase import create_client
+from hive_rpc import router, rpc_call
+from hive_content import invalidate_content
+from broadcaster import broadcaster
+from resilience import retry_call, backoff_delay
+from block_store import block_store
+from metrics import metrics
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -17,112 +27,199 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 # Initialize Supabase client
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-HIVE_API = [
-    'https://api.hive.blog',
-    'https://api.deathwing.me',
-    'https://api.openhive.network'
-]
 SLEEP_INTERVAL = 5
+# Race latency-critical calls against a second node when the first one lags
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'true').lower() in ('1', 'true', 'yes')
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', 2))  # Block windows fetched ahead of the reply work
+HEAD_DEADLINE = float(os.getenv('HEAD_DEADLINE', 20))  # Seconds all attempts to read the head block may take
+BLOCK_RANGE_DEADLINE = float(os.getenv('BLOCK_RANGE_DEADLINE', 60))  # Seconds all attempts to fetch one window may take
+# Catch-up mode, used while the bot is far behind the head
+CATCHUP_THRESHOLD = int(os.getenv('CATCHUP_THRESHOLD', 200))  # Blocks behind the head that start a parallel catch-up
+CATCHUP_WORKERS = int(os.getenv('CATCHUP_WORKERS', 4))  # Ranges fetched at once, spread over the nodes
+CATCHUP_MAX_WINDOW = 1000  # Most blocks block_api.get_block_range returns at once
+CATCHUP_TARGET_LATENCY = float(os.getenv('CATCHUP_TARGET_LATENCY', 3))  # Seconds a range may take before the window shrinks
+CATCHUP_TARGET_BYTES = int(os.getenv('CATCHUP_TARGET_BYTES', 16 * 1024 * 1024))  # Payload of a range before the window shrinks
+
+# Byte patterns of the raw block_api JSON, used to skip decoding the operations nobody needs
+BLOCK_START = b'{"previous":"'
+TIMESTAMP_REGEX = re.compile(rb'"timestamp":"([^"]+)"')
+COMMENT_OPERATION = b'"type":"comment_operation","value":'
+COMMENT_HEADER_REGEX = re.compile(
+    re.escape(COMMENT_OPERATION) + rb'\{"parent_author":"([^"]*)","parent_permlink":"([^"]*)","author":"([^"]*)","permlink":"([^"]*)"')
+BOT_NAME_REGEX = re.compile(rb'llamathreads', re.IGNORECASE)
+BLOCK_END_KEY = b'"transaction_ids":['  # Last field of a block object
+
+# Last irreversible block seen with the head, only blocks up to it are stored
+irreversible_block_num = 0
 
 def get_latest_block_num():
     """Get the latest block number from the HIVE blockchain."""
-    data = {
-        "jsonrpc": "2.0",
-        "method": "condenser_api.get_dynamic_global_properties",
-        "params": [],
-        "id": 1
-    }
-    retries = 10
-    api_index = 0
-    while retries > 0:
-        try:
-            response = requests.post(HIVE_API[api_index % len(HIVE_API)], json=data).json()
-            result = response.get('result')
-            if result:
-                return result['head_block_number']
-            else:
-                print(f"Failed to get latest block number from {HIVE_API[api_index % len(HIVE_API)]}. Retrying...")
-                time.sleep(SLEEP_INTERVAL / 10)
-                retries -= 1
-                api_index += 1  # Switch to the next API on each retry
-        except Exception as e:
-            print(f"Exception while fetching latest block number from {HIVE_API[api_index % len(HIVE_API)]}: {e}")
-            time.sleep(SLEEP_INTERVAL / 10)
-            retries -= 1
-            api_index += 1  # Switch to the next API on each retry
-    print("Max retries exceeded. Aborting.")
-    raise Exception("Failed to fetch latest block number after multiple retries.")
-
-def get_block_range(start_block, end_block):
-    """Fetch a range of blocks from the HIVE blockchain using block_api.get_block_range."""
-    if start_block == end_block:
+    global irreversible_block_num
+    # The router picks the fastest healthy node and skips the ones whose circuit is open
+    response = retry_call(
+        lambda: rpc_call("condenser_api.get_dynamic_global_properties", [], hedge=HEDGE_REQUESTS, validate=lambda r: r.get('result')),
+        "Fetching the latest block number", attempts=10, base_delay=SLEEP_INTERVAL / 10, deadline=HEAD_DEADLINE)
+    irreversible_block_num = max(irreversible_block_num, response['result'].get('last_irreversible_block_num', 0))
+    return response['result']['head_block_number']
+
+def get_block_range_raw(start_block, end_block, wait=True, node=None):
+    """Fetch a range of blocks using block_api.get_block_range and return the undecoded response body.
+
+    node pins the first attempt to one API node; retries go through the router.
+    """
+    if start_block == end_block and wait:
         print(f"Waiting for more blocks before fetching...")
         time.sleep(SLEEP_INTERVAL)
-    data = {
-        "jsonrpc": "2.0",
-        "method": "block_api.get_block_range",
-        "params": {
-            "starting_block_num": start_block,
-            "count": end_block - start_block + 1
-        },
-        "id": 1
+    params = {
+        "starting_block_num": start_block,
+        "count": end_block - start_block + 1
     }
-    retries = 10
-    api_index = 0
-    while retries > 0:
-        try:
-            response = requests.post(HIVE_API[api_index % len(HIVE_API)], json=data).json()
-            result = response.get('result')
-            if result['blocks']:
-                print(f"Fetched block range {start_block} to {end_block} from {HIVE_API[api_index % len(HIVE_API)]}")
-                return result['blocks']
-            else:
-                print(f"Failed to fetch block range {start_block} to {end_block} from {HIVE_API[api_index % len(HIVE_API)]}. Retrying...")
-                time.sleep(SLEEP_INTERVAL)
-                retries -= 1
-                api_index += 1  # Switch to the next API on each retry
-        except Exception as e:
-            print(f"Exception while fetching block range {start_block} to {end_block} from {HIVE_API[api_index % len(HIVE_API)]}: {e}")
-            time.sleep(SLEEP_INTERVAL)
-            retries -= 1
-            api_index += 1  # Switch to the next API on each retry
-    print("Max retries exceeded. Aborting.")
-    raise Exception("Failed to fetch block data after multiple retries.")
+    # A node that is behind the head returns fewer blocks or none, which counts as a node
+    # error so the range is fetched again from another node instead of skipping blocks
+    validate = lambda r: r.count(BLOCK_START) == params["count"]
+    pinned = [node] if node else []
+
+    def fetch():
+        if pinned:
+            return router.call_node(pinned.pop(), "block_api.get_block_range", params, validate=validate, raw=True)
+        return rpc_call("block_api.get_block_range", params, hedge=HEDGE_REQUESTS, validate=validate, raw=True)
+
+    with metrics.timed('block_fetch'):
+        response = retry_call(fetch, f"Fetching block range {start_block} to {end_block}", attempts=10, base_delay=1,
+                              max_delay=SLEEP_INTERVAL * 2, deadline=BLOCK_RANGE_DEADLINE)
+    print(f"Fetched block range {start_block} to {end_block}")
+    return response
+
+def get_block_range(start_block, end_block, wait=True):
+    """Fetch a range of blocks from the HIVE blockchain using block_api.get_block_range."""
+    return json.loads(get_block_range_raw(start_block, end_block, wait=wait))['result']['blocks']
 
 def load_last_block():
     """Load the last processed block number from Supabase."""
-    response = supabase.table('blocks').select('block_num').eq('_id', 'last_block').execute()
+    with metrics.timed('supabase', operation='load_last_block'):
+        response = supabase.table('blocks').select('block_num').eq('_id', 'last_block').execute()
     if response.data:
         return response.data[0]['block_num']
     return None
 
 def save_last_block(block_num):
     """Save the last processed block number to Supabase."""
-    response = supabase.table('blocks').upsert({'_id': 'last_block', 'block_num': block_num}).execute()
+    with metrics.timed('supabase', operation='save_last_block'):
+        response = supabase.table('blocks').upsert({'_id': 'last_block', 'block_num': block_num}).execute()
     print(f"Saved last block: {block_num}")
 
-def listen_for_comments(start_block, end_block):
-    """Listen for comments in a range of blocks and process them."""
-    blocks = get_block_range(start_block, end_block)
+def listen_for_comments(start_block, end_block, wait=True):
+    """Listen for comments in a range of blocks and process them.
+
+    Set wait to False when following the head, where a single-block range is expected.
+    """
+    return scan_raw_blocks(read_blocks(start_block, end_block, wait=wait))
+
+def read_blocks(start_block, end_block, wait=True, node=None):
+    """Return the raw bytes of each block in a range, from the block store where possible.
+
+    Blocks missing from the store are fetched from the network, and the
+    irreversible ones among them are added to the store.
+    """
+    raw_blocks = block_store.read_range(start_block, end_block) if block_store else []
+    if raw_blocks:
+        metrics.inc('blocks_read_total', len(raw_blocks), source='store')
+        print(f"Read blocks {start_block} to {start_block + len(raw_blocks) - 1} from the block store")
+    fetch_from = start_block + len(raw_blocks)
+    if fetch_from > end_block:
+        return raw_blocks
+    fetched = [trim_block(raw_block) for raw_block in split_blocks(get_block_range_raw(fetch_from, end_block, wait=wait and not raw_blocks, node=node))]
+    metrics.inc('blocks_read_total', len(fetched), source='network')
+    if block_store:
+        for block_num, raw_block in enumerate(fetched, fetch_from):
+            if block_num > irreversible_block_num:
+                break
+            block_store.append(block_num, raw_block)
+    return raw_blocks + fetched
+
+def trim_block(raw_block):
+    """Cut the array separators and response envelope off a block slice."""
+    end = raw_block.find(b']}', raw_block.rfind(BLOCK_END_KEY))
+    return raw_block[:end + 2] if end >= 0 else raw_block
+
+def split_blocks(raw):
+    """Split a raw get_block_range response into the bytes of each block.
+
+    Every block object starts with its "previous" field, and that key with its
+    unescaped quotes cannot occur inside a JSON string. A slice may carry
+    trailing separators of the surrounding array, which raw_decode ignores.
+    """
+    return [BLOCK_START + part for part in raw.split(BLOCK_START)[1:]]
+
+def comment_from_operation(comment_data, block_timestamp):
+    """Record a decoded comment_operation and return it as a comment dict if it targets the bot."""
+    # A new comment_operation on an existing permlink is an edit
+    invalidate_content(comment_data['author'], comment_data['permlink'])
+    # Our own replies showing up in a block confirm their broadcast
+    broadcaster.observe(comment_data['author'], comment_data['permlink'])
+    if comment_data['parent_author'] != '':
+        comment = {
+            'author': comment_data['author'],
+            'permlink': comment_data['permlink'],
+            'parent_author': comment_data['parent_author'],
+            'parent_permlink': comment_data['parent_permlink'],
+            'body': comment_data['body'],
+            'metadata': comment_data["json_metadata"],
+            'block_timestamp': block_timestamp
+        }
+        if is_target_comment(comment):
+            return comment
+    return None
+
+def scan_block(block):
+    """Find the target comments of a fully decoded block."""
     comments = []
-    for block in blocks:
-        block_timestamp = block['timestamp']  # Use timestamp directly for transaction
-        for transaction in block['transactions']:
-            for operation in transaction['operations']:
-                if operation['type'] == 'comment_operation':
-                    comment_data = operation['value']
-                    if comment_data['parent_author'] != '':
-                        comment = {
-                            'author': comment_data['author'],
-                            'permlink': comment_data['permlink'],
-                            'parent_author': comment_data['parent_author'],
-                            'parent_permlink': comment_data['parent_permlink'],
-                            'body': comment_data['body'],
-                            'metadata': comment_data["json_metadata"],
-                            'block_timestamp': block_timestamp
-                        }
-                        if is_target_comment(comment):
-                            comments.append(comment)
+    block_timestamp = block['timestamp']  # Use timestamp directly for transaction
+    for transaction in block['transactions']:
+        for operation in transaction['operations']:
+            if operation['type'] == 'comment_operation':
+                comment = comment_from_operation(operation['value'], block_timestamp)
+                if comment:
+                    comments.append(comment)
+    return comments
+
+def scan_raw_block(raw_block):
+    """Find the target comments of a raw block, decoding only the operations that can match.
+
+    Comment headers (authors and permlinks) are read with a byte pattern so every
+    comment still invalidates the cache and confirms our broadcasts. A comment is
+    decoded only when it replies to the bot or its bytes contain the bot's name.
+    Blocks laid out differently than expected are decoded in full.
+    """
+    decoder = json.JSONDecoder()
+    headers = list(COMMENT_HEADER_REGEX.finditer(raw_block))
+    if len(headers) != raw_block.count(COMMENT_OPERATION):
+        return scan_block(decoder.raw_decode(raw_block.decode('utf-8'))[0])
+    comments = []
+    block_timestamp = None
+    for index, header in enumerate(headers):
+        parent_author, _, author, permlink = (group.decode('utf-8') for group in header.groups())
+        start = header.start() + len(COMMENT_OPERATION)
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(raw_block)
+        if parent_author.lower() != 'llamathreads' and not BOT_NAME_REGEX.search(raw_block, start, end):
+            invalidate_content(author, permlink)
+            broadcaster.observe(author, permlink)
+            continue
+        if block_timestamp is None:
+            block_timestamp = TIMESTAMP_REGEX.search(raw_block).group(1).decode('utf-8')
+        comment_data = decoder.raw_decode(raw_block[start:end].decode('utf-8'))[0]
+        comment = comment_from_operation(comment_data, block_timestamp)
+        if comment:
+            comments.append(comment)
+    return comments
+
+def scan_raw_blocks(raw_blocks):
+    """Return the target comments of a list of raw blocks, in block order."""
+    comments = []
+    with metrics.timed('block_scan'):
+        for raw_block in raw_blocks:
+            comments.extend(scan_raw_block(raw_block))
+    metrics.inc('target_comments_total', len(comments))
     return comments
 
 def is_target_comment(comment):
@@ -134,3 +231,130 @@ def is_target_comment(comment):
     if comment['parent_author'].lower() == 'llamathreads':
         return True
     return False
+
+class BlockPrefetcher:
+    """Fetch and filter block windows in the background while earlier windows are answered.
+
+    Iterating yields (start_block, end_block, latest_block_num, comments) in block order.
+    At most `depth` windows wait in the queue, which caps memory. Without `follow`
+    the iteration ends once the head is reached; with it the producer keeps polling.
+
+    While more than CATCHUP_THRESHOLD blocks behind the head, ranges are fetched
+    CATCHUP_WORKERS at a time from different nodes and queued in block order. The
+    range size adapts to the fetches (doubling at first, then additive increase
+    while they are fast and small, halving when one is slow, heavy or fails), up
+    to CATCHUP_MAX_WINDOW.
+    Near the head the producer returns to single windows of block_range.
+    """
+
+    def __init__(self, start_block, block_range, follow=False, depth=PREFETCH_DEPTH, poll_interval=3):
+        self.start_block = start_block
+        self.block_range = block_range
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.next_block = start_block
+        self.window = block_range
+        self.slow_start = True  # Double the window until the first slow fetch, then grow it linearly
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, name='block-prefetch', daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _fetch_range(self, start_block, end_block, node):
+        """Fetch and scan one catch-up range, adapting the window to how the fetch went."""
+        fetch_start = time.monotonic()
+        try:
+            raw_blocks = read_blocks(start_block, end_block, wait=False, node=node)
+        except Exception:
+            self.slow_start = False
+            self.window = max(self.block_range, self.window // 2)
+            raise
+        latency = time.monotonic() - fetch_start
+        payload = sum(len(raw_block) for raw_block in raw_blocks)
+        if latency > CATCHUP_TARGET_LATENCY or payload > CATCHUP_TARGET_BYTES:
+            self.slow_start = False
+            self.window = max(self.block_range, self.window // 2)
+        else:
+            self.window = min(CATCHUP_MAX_WINDOW, self.window * 2 if self.slow_start else self.window + self.block_range)
+        return scan_raw_blocks(raw_blocks)
+
+    def _catch_up(self, latest_block_num):
+        """Queue the windows up to latest_block_num, fetching several ranges at once."""
+        print(f"{latest_block_num - self.next_block + 1} blocks behind the head. Catching up with {CATCHUP_WORKERS} parallel fetches.")
+        executor = ThreadPoolExecutor(max_workers=CATCHUP_WORKERS, thread_name_prefix='catch-up')
+        pending = deque()  # (start_block, end_block, future) in block order
+        next_start = self.next_block
+        try:
+            while (pending or next_start <= latest_block_num) and not self.stop_event.is_set():
+                nodes = router.ranked()
+                while len(pending) < CATCHUP_WORKERS and next_start <= latest_block_num:
+                    end_block = min(next_start + self.window - 1, latest_block_num)
+                    node = nodes[len(pending) % len(nodes)]
+                    pending.append((next_start, end_block, executor.submit(self._fetch_range, next_start, end_block, node)))
+                    next_start = end_block + 1
+                start_block, end_block, future = pending.popleft()
+                comments = future.result()
+                self._put((start_block, end_block, latest_block_num, comments))
+                self.next_block = end_block + 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _produce(self):
+        latest_block_num = None
+        errors = 0
+        while not self.stop_event.is_set():
+            try:
+                if latest_block_num is None:
+                    latest_block_num = get_latest_block_num()
+                if self.next_block > latest_block_num:
+                    if not self.follow:
+                        self._put(None)
+                        return
+                    # Wait for the chain to produce the next block
+                    time.sleep(self.poll_interval)
+                    latest_block_num = get_latest_block_num()
+                    continue
+                if latest_block_num - self.next_block + 1 > CATCHUP_THRESHOLD:
+                    self._catch_up(latest_block_num)
+                else:
+                    end_block = min(self.next_block + self.block_range - 1, latest_block_num)
+                    comments = listen_for_comments(self.next_block, end_block, wait=not self.follow)
+                    self._put((self.next_block, end_block, latest_block_num, comments))
+                    self.next_block = end_block + 1
+                errors = 0
+                latest_block_num = get_latest_block_num()
+                if self.next_block == latest_block_num and not self.follow:
+                    self._put(None)
+                    return
+            except Exception as e:
+                # Hand the error to the consumer and retry the same window afterwards
+                print(f"Exception while prefetching blocks from {self.next_block}: {e}")
+                self._put(e)
+                latest_block_num = None
+                errors += 1
+                time.sleep(backoff_delay(errors, base_delay=1, max_delay=SLEEP_INTERVAL * 6))
+
+    def __iter__(self):
+        while True:
+            item = self.next_window()
+            if item is None:
+                return
+            yield item
+
+    def next_window(self):
+        """Return the next window, or None once the head is reached; raises the producer's errors."""
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import re
+import hashlib
+import threading
+import logging
+from concurrent.futures import Future
+from ttl_cache import TTLCache
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 500))
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 900))  # Seconds an answer may be reused for an identical request
+AUTHOR_PLACEHOLDER = '@{prompt_author}'  # Stands in for the asking user so identical questions of different users match
+
+def mask_author(text, author):
+    """Replace mentions of author (but not of longer names starting with it) with the placeholder."""
+    return re.sub(rf"@{re.escape(author)}(?![\w.-])", lambda _: AUTHOR_PLACEHOLDER, text)
+
+def normalize_text(text, author=None):
+    """Collapse whitespace and case, and replace the asking user's handle with a placeholder."""
+    if author:
+        text = mask_author(text, author)
+        if text == f"user_{author}":
+            text = 'user_{prompt_author}'
+    return ' '.join(text.split()).lower()
+
+def request_key(model, system_prompt, prompt, messages, author=None):
+    """Hash of everything that shapes an answer, normalized so near-identical requests collide."""
+    normalized = [
+        normalize_text(model),
+        normalize_text(system_prompt or ''),
+        normalize_text(prompt, author),
+        [[normalize_text(message['role'], author), normalize_text(message['content'], author)] for message in messages]
+    ]
+    return hashlib.sha256(json.dumps(normalized).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """TTL cache of LLM answers that also collapses identical requests in flight.
+
+    The first caller of a key runs the generation; concurrent callers of the same
+    key wait for its result instead of starting their own backend call. Failed
+    generations (None or an exception) are shared with the waiters but not cached.
+    """
+
+    def __init__(self, maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.inflight = {}  # key -> Future of the running generation
+        self.lock = threading.Lock()
+        self.backend_calls = 0
+        self.collapsed = 0
+        self.saved_seconds = 0.0
+
+    def get_or_generate(self, key, generate, author=None):
+        """Return the answer for key, calling generate() only if nobody has or is producing it."""
+        cached = self.cache.get(key)
+        if cached is not None:
+            text, seconds = cached
+            with self.lock:
+                self.saved_seconds += seconds
+            logger.info(f"LLM cache hit, saved ~{seconds:.1f}s of generation.")
+            return text.replace(AUTHOR_PLACEHOLDER, f"@{author}") if author else text
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+                self.backend_calls += 1
+            else:
+                self.collapsed += 1
+        if not owner:
+            logger.info("Identical LLM request already running, waiting for its answer.")
+            text = future.result()
+            return text.replace(AUTHOR_PLACEHOLDER, f"@{author}") if text and author else text
+        start = time.monotonic()
+        try:
+            text = generate()
+        except Exception as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        seconds = time.monotonic() - start
+        # Answers are stored and shared without the asking user's handle
+        generic = mask_author(text, author) if text and author else text
+        if generic is not None:
+            self.cache.set(key, (generic, seconds))
+        with self.lock:
+            del self.inflight[key]
+        future.set_result(generic)
+        return text
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self.lock:
+            stats.update(backend_calls=self.backend_calls, collapsed=self.collapsed, saved_seconds=round(self.saved_seconds, 1))
+        return stats
+
+# Shared cache used by the reply pool
+response_cache = ResponseCache()
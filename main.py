@@ -1,10 +1,17 @@
 import os
 import sys
+import time
 import threading
-from listener import get_latest_block_num, get_block_range, load_last_block, save_last_block, listen_for_comments
-from reply import talk_to_gpt, post_reply, fetch_comment_chain
-from leosub import list_all_users  # Import the list_all_users function
+from listener import get_latest_block_num, load_last_block, save_last_block, listen_for_comments, BlockPrefetcher
+from reply_pool import ReplyPool
+from subscriptions import SubscriptionIndex
 from container_thread import container_thread_creator  # Added import for container_thread_creator
+from hive_content import content_cache
+from llm_cache import response_cache
+from resilience import is_transient, backoff_delay, Deadline
+from broadcaster import broadcaster
+from checkpoint_log import checkpoint_log
+from metrics import metrics, MetricsExporter
 from datetime import datetime
 import logging  # Configure logging
 
@@ -15,90 +22,220 @@ logger = logging.getLogger()
 # Configuration
 BLOCK_RANGE = 50
 QUIT_TIMEOUT = 30  # 30 seconds timeout for quitting on error
+# Follow mode keeps the process attached to the chain head instead of exiting once caught up
+FOLLOW_MODE = os.getenv('FOLLOW_MODE', 'false').lower() in ('1', 'true', 'yes') or '--follow' in sys.argv
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', 3))  # Hive produces a block every 3 seconds
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', 600))  # Same cadence as the old 10 minute cron run
+# Outside follow mode an outage is only ridden out this long, so a run ends before the next scheduled one starts
+OUTAGE_DEADLINE = float(os.getenv('OUTAGE_DEADLINE', 300))
+# In follow mode a window that keeps failing with a non-transient error is skipped after this many attempts
+WINDOW_MAX_ATTEMPTS = int(os.getenv('WINDOW_MAX_ATTEMPTS', 5))
 
 # Instructional message for non-subscribers
 INSTRUCTIONAL_MESSAGE = """It appears that you're not subscribed to **Llamathreads.** Please Subscribe and Try again.
 * [Usage Instructions.](https://inleo.io/threads/view/llamathreads/re-leothreads-2tychfjaq?referral=llamathreads)
 * Tag @ `ahmadmanga` for reporting issues."""
 
+def run_maintenance():
+    """Post the container thread if it is due."""
+    # Call the container_thread_creator function with error handling
+    try:
+        logger.info("Starting container_thread_creator...")
+        start_time = datetime.now()
+        container_thread_creator()
+        end_time = datetime.now()
+        logger.info(f"Container thread creation attempted. Duration: {end_time - start_time}")
+    except Exception as e:
+        logger.error(f"Error in container_thread_creator: {e}")
+
+def process_comment(comment, subscriptions, pool):
+    """Reply to a single fetched comment using the stages of the reply pool."""
+    # Ensure the comment body is encoded in UTF-8
+    comment_body = comment['body'].encode('utf-8', errors='replace').decode('utf-8')
+    print(f"Fetched comment by @{comment['author']} on {comment['block_timestamp']}: {comment_body}")
+    comment_id = f"{comment['author']}/{comment['permlink']}"
+    checkpoint_log.mark(comment_id, 'seen')
+
+    # Check if the commenter is a subscriber
+    if comment['author'] in subscriptions:
+        # Fetch the comment chain messages
+        messages = pool.build_chain(comment)
+
+        # Generate a response using the AI
+        prompt = comment_body
+        response = pool.generate(prompt, messages, comment['author'])
+
+        if response:
+            checkpoint_log.mark(comment_id, 'generated')
+            reply_text = response  # Directly use the response text
+            # Post the reply to the Hive blockchain
+            pool.broadcast(comment, reply_text)
+            metrics.inc('comments_answered_total', reply='generated')
+        else:
+            # A subscriber is never told to subscribe because the LLM failed, the comment stays unanswered
+            logger.error(f"No response generated for {comment_id}, leaving it unanswered.")
+            metrics.inc('comments_unanswered_total')
+    else:
+        pool.broadcast(comment, INSTRUCTIONAL_MESSAGE)
+        metrics.inc('comments_answered_total', reply='instructions')
+
+def process_window(window, subscriptions, pool, follow=FOLLOW_MODE):
+    """Answer the comments of one prefetched window and return the next block to process.
+
+    The cursor only moves past the window once its replies are broadcast.
+    """
+    start_block, end_block, latest_block_num, comments = window
+    metrics.set('blocks_behind_head', max(0, latest_block_num - end_block))
+    # Comments answered before a restart are not answered twice
+    answered = [comment for comment in comments if checkpoint_log.is_broadcast(f"{comment['author']}/{comment['permlink']}")]
+    if answered:
+        logger.info(f"Skipping {len(answered)} comments that were already answered.")
+        comments = [comment for comment in comments if comment not in answered]
+    pool.run(comments, lambda comment: process_comment(comment, subscriptions, pool))
+    # The replies of the window are on chain before the cursor moves past it
+    broadcaster.flush()
+    for permlink in broadcaster.unconfirmed():
+        logger.warning(f"Reply {permlink} was not seen in the fetched blocks yet.")
+
+    # Save the next block to process once the window is answered
+    last_block = end_block + 1
+    checkpoint_log.save_cursor(last_block)
+    if follow:
+        # Long-running processes keep their local log, Supabase gets the cursor periodically
+        checkpoint_log.maybe_flush(save_last_block)
+    else:
+        # Scheduled runs start on a fresh machine without the local log
+        checkpoint_log.flush(save_last_block)
+    logger.info(f"Updated last_block: {last_block}, end_block: {end_block}, latest_block_num: {latest_block_num}")
+    for cache_name, cache in (('content_cache', content_cache), ('llm_cache', response_cache)):
+        for stat, value in cache.stats().items():
+            metrics.set(f'{cache_name}_{stat}', value)
+    if comments:
+        logger.info(f"Content cache: {content_cache.stats()}")
+        logger.info(f"LLM cache: {response_cache.stats()}")
+    return last_block
+
 def main():
     # Load the last processed block number or get the latest block number if not available
     latest_block_num = get_latest_block_num()
-    last_block = load_last_block() or latest_block_num
+    # The local cursor is saved every window, Supabase only every few minutes, so use whichever is further
+    last_block = max(filter(None, [checkpoint_log.load_cursor(), load_last_block()]), default=latest_block_num)
     end_block = last_block + BLOCK_RANGE - 1
     if latest_block_num < end_block:
         end_block = latest_block_num
     logger.info(f"Initial last_block: {last_block}, end_block: {end_block}, latest_block_num: {latest_block_num}")
 
-    # Get the list of all users (subscribers and buyers)
-    all_users = list_all_users()
+    # Load subscribers, free-trial users and buyers once, then keep them fresh in the background
+    subscriptions = SubscriptionIndex()
+    subscriptions.refresh()
+    subscriptions.start()
     logger.info("Subscribers list generated.")
 
-    # Call the container_thread_creator function with error handling
-    try:
-        logger.info("Starting container_thread_creator...")
-        start_time = datetime.now()
-        container_thread_creator()
-        end_time = datetime.now()
-        logger.info(f"Container thread creation attempted. Duration: {end_time - start_time}")
-    except Exception as e:
-        logger.error(f"Error in container_thread_creator: {e}")
+    exporter = MetricsExporter(metrics)
+    exporter.start()
 
-    # Start listening for comments
+    run_maintenance()
+    last_maintenance = time.monotonic()
+    pool = ReplyPool()
+    if FOLLOW_MODE:
+        logger.info(f"Follow mode enabled. Polling the chain head every {POLL_INTERVAL} seconds.")
+
+    # Start listening for comments, the next windows are fetched while the current one is answered
+    prefetcher = BlockPrefetcher(last_block, BLOCK_RANGE, follow=FOLLOW_MODE, poll_interval=POLL_INTERVAL)
+    errors = 0
+    failures = 0  # Non-transient errors since the last answered window, which are not retried forever
+    outage = None
+    # A window is only dropped once it has been answered, a failed one is run again after the backoff
+    window = None
     while True:
         try:
-            # Check if the last block is already the latest block
-            if last_block > latest_block_num:
-                logger.info("Last block is greater than the latest block. Exiting the application.")
-                save_last_block(last_block)
-                break
-
-            # Fetch comments within the valid block range
-            comments = listen_for_comments(last_block, end_block)
-            for comment in comments:
-                # Ensure the comment body is encoded in UTF-8
-                comment_body = comment['body'].encode('utf-8', errors='replace').decode('utf-8')
-                print(f"Fetched comment by @{comment['author']} on {comment['block_timestamp']}: {comment_body}")
-
-                # Check if the commenter is a subscriber
-                if comment['author'] in all_users:
-                    # Fetch the comment chain messages
-                    messages = fetch_comment_chain(comment)
-
-                    # Generate a response using the AI
-                    system_prompt = None
-                    prompt = comment_body
-                    response = talk_to_gpt(prompt, system_prompt=None, messages=messages)
-
-                    if response:
-                        reply_text = response  # Directly use the response text
-                        # Post the reply to the Hive blockchain
-                        post_reply(comment, reply_text)
-                    else:
-                        # Post the instructional message if the user is not a subscriber
-                        post_reply(comment, INSTRUCTIONAL_MESSAGE)
-                else:
-                    post_reply(comment, INSTRUCTIONAL_MESSAGE)
-
-            # Update the block range for the next iteration
-            last_block = end_block + 1
-            end_block = last_block + BLOCK_RANGE - 1
-            latest_block_num = get_latest_block_num()
-            if latest_block_num < end_block:
-                end_block = latest_block_num
-
-            # Save last_block before exiting if reached the latest block
-            save_last_block(last_block)
-            logger.info(f"Updated last_block: {last_block}, end_block: {end_block}, latest_block_num: {latest_block_num}")
-            if last_block == latest_block_num:
-                print("Last block is the same as the latest block. Exiting the application.")
-                save_last_block(last_block)
-                break
-
-            # Quit the loop to exit
+            if window is None:
+                window = prefetcher.next_window()
+                if window is None:
+                    print("Last block is the same as the latest block. Exiting the application.")
+                    break
+            # Long-running processes repeat the startup maintenance on the old cron cadence
+            if FOLLOW_MODE and time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                run_maintenance()
+                last_maintenance = time.monotonic()
+
+            metrics.set('prefetch_queue_depth', prefetcher.queue.qsize())
+            last_block = process_window(window, subscriptions, pool)
+            window = None
+            errors = 0
+            failures = 0
         except Exception as e:
             print(f"An error occurred: {e}")
+            # Replies queued before the error are posted, so the retry skips their comments
+            broadcaster.flush()
+            if errors == 0:
+                outage = Deadline(None if FOLLOW_MODE else OUTAGE_DEADLINE)
+            if not is_transient(e):
+                failures += 1
+            if FOLLOW_MODE and failures >= WINDOW_MAX_ATTEMPTS:
+                if window is None:
+                    logger.error(f"Giving up after {failures} failed attempts to fetch the next window.")
+                    quit_if_timeout()
+                    continue
+                # A window that cannot be answered must not stall the head forever
+                start_block, end_block = window[0], window[1]
+                unanswered = [f"{comment['author']}/{comment['permlink']}" for comment in window[3]
+                              if not checkpoint_log.is_broadcast(f"{comment['author']}/{comment['permlink']}")]
+                logger.error(f"Skipping blocks {start_block} to {end_block} after {failures} failed attempts, "
+                             f"unanswered comments: {unanswered}")
+                last_block = end_block + 1
+                checkpoint_log.save_cursor(last_block)
+                window = None
+                errors = 0
+                failures = 0
+                continue
+            if FOLLOW_MODE or (is_transient(e) and not outage.expired()):
+                # Node, network and LLM outages are ridden out with backoff instead of exiting
+                errors += 1
+                delay = backoff_delay(errors, base_delay=1, max_delay=60)
+                remaining = outage.remaining()
+                time.sleep(delay if remaining is None else min(delay, remaining))
+                continue
+            if is_transient(e):
+                logger.error(f"Giving up after {errors} failed attempts over {OUTAGE_DEADLINE:.0f}s.")
             quit_if_timeout()
+    prefetcher.stop()
+    subscriptions.stop()
+    pool.shutdown()
+    broadcaster.stop()
+    checkpoint_log.flush(save_last_block)
+    exporter.stop()
+
+def replay(start_block, end_block, dry_run=False):
+    """Run the comment pipeline over a block range, reading stored blocks from disk.
+
+    Blocks missing from the block store are fetched from the network. The saved
+    last block is left alone. With dry_run the matching comments are only listed.
+    """
+    logger.info(f"Replaying blocks {start_block} to {end_block}{' (dry run)' if dry_run else ''}.")
+    # Knowing the last irreversible block lets fetched blocks go into the store
+    get_latest_block_num()
+    subscriptions = None
+    pool = None
+    if not dry_run:
+        subscriptions = SubscriptionIndex()
+        subscriptions.refresh()
+        pool = ReplyPool()
+    matched = 0
+    for window_start in range(start_block, end_block + 1, BLOCK_RANGE):
+        window_end = min(window_start + BLOCK_RANGE - 1, end_block)
+        comments = listen_for_comments(window_start, window_end, wait=False)
+        matched += len(comments)
+        if dry_run:
+            for comment in comments:
+                print(f"[dry run] @{comment['author']}/{comment['permlink']} on {comment['block_timestamp']}: {comment['body'][:80]}")
+            continue
+        pool.run(comments, lambda comment: process_comment(comment, subscriptions, pool))
+        broadcaster.flush()
+    logger.info(f"Replay finished, {matched} comments matched.")
+    if pool:
+        pool.shutdown()
+    broadcaster.stop()
 
 def quit_if_timeout():
     """Wait for user input or timeout to quit the application."""
@@ -109,7 +246,17 @@ def quit_if_timeout():
     timeout_event.wait(QUIT_TIMEOUT)
     if not timeout_event.is_set():
         print("Timeout reached. Exiting the application.")
+        # os._exit skips the normal shutdown, the cursor still has to reach Supabase
+        try:
+            checkpoint_log.flush(save_last_block)
+        except Exception as e:
+            logger.error(f"Error saving the checkpoint before exiting: {e}")
         os._exit(1)
 
 if __name__ == "__main__":
-    main()
+    if '--replay' in sys.argv:
+        # python main.py --replay START END [--dry-run]
+        replay_index = sys.argv.index('--replay')
+        replay(int(sys.argv[replay_index + 1]), int(sys.argv[replay_index + 2]), dry_run='--dry-run' in sys.argv)
+    else:
+        main()
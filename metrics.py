@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import threading
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+METRICS_PREFIX = 'llamathreads_'
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # Local port serving /metrics, 0 disables the endpoint
+METRICS_FILE = os.getenv('METRICS_FILE', '')  # File the metrics are dumped to periodically, empty disables the dump
+METRICS_DUMP_INTERVAL = int(os.getenv('METRICS_DUMP_INTERVAL', 60))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # Upper bounds in seconds
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """In-process counters, gauges and latency histograms.
+
+    Every metric is keyed by its name and labels. timed() wraps a pipeline stage
+    and records its latency in <stage>_seconds and its failures in
+    <stage>_errors_total, which is enough to tell slow nodes, a slow LLM and
+    slow code of our own apart. render() returns the Prometheus text format.
+    """
+
+    def __init__(self, prefix=METRICS_PREFIX, buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}  # name -> {labels: value}
+        self.gauges = {}
+        self.histograms = {}  # name -> {labels: [count per bucket + overflow, sum, count]}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def add(self, name, value, **labels):
+        """Move a gauge up or down by value."""
+        with self.lock:
+            series = self.gauges.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timed(self, stage, **labels):
+        """Record the latency of the wrapped block, and count it as an error if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f'{stage}_errors_total', **labels)
+            raise
+        finally:
+            self.observe(f'{stage}_seconds', time.perf_counter() - start, **labels)
+
+    def value(self, name, **labels):
+        """Return the current value of a counter or gauge, or the observation count of a histogram."""
+        key = _label_key(labels)
+        with self.lock:
+            if name in self.counters:
+                return self.counters[name].get(key, 0)
+            if name in self.gauges:
+                return self.gauges[name].get(key, 0)
+            histogram = self.histograms.get(name, {}).get(key)
+            return histogram[-1] if histogram else 0
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(metrics):
+                    lines.append(f'# TYPE {self.prefix}{name} {kind}')
+                    for labels, value in sorted(metrics[name].items()):
+                        lines.append(f'{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}')
+            for name in sorted(self.histograms):
+                lines.append(f'# TYPE {self.prefix}{name} histogram')
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(list(self.buckets) + ['+Inf'], histogram):
+                        cumulative += count
+                        lines.append(f'{self.prefix}{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{self.prefix}{name}_sum{_format_labels(labels)} {_format_value(histogram[-2])}')
+                    lines.append(f'{self.prefix}{name}_count{_format_labels(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write the metrics to path, replacing the previous dump in one step."""
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as handle:
+            handle.write(self.render())
+        os.replace(temporary_path, path)
+
+class MetricsExporter:
+    """Serves a registry on http://127.0.0.1:<port>/metrics and/or dumps it to a file periodically."""
+
+    def __init__(self, registry, port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_DUMP_INTERVAL):
+        self.registry = registry
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.server = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.port:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = registry.render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+            logger.info(f"Serving metrics on http://127.0.0.1:{self.port}/metrics")
+        if self.path:
+            self.thread = threading.Thread(target=self._run, name='metrics-dump', daemon=True)
+            self.thread.start()
+            logger.info(f"Dumping metrics to {self.path} every {self.interval} seconds.")
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.registry.dump(self.path)
+            except OSError as e:
+                logger.error(f"Error while dumping metrics to {self.path}: {e}")
+
+    def stop(self):
+        """Stop serving and write a last dump."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+            self.registry.dump(self.path)
+
+# Shared registry every module records into
+metrics = MetricsRegistry()
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import threading
+import logging
+from beem.amount import Amount
+from beem.transactionbuilder import TransactionBuilder
+from beemapi.exceptions import RPCError
+from beembase import operations
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+MAX_TX_SIZE = int(os.getenv('MAX_TX_SIZE', 60000))  # Hive rejects transactions above 64 KiB, the rest is headroom for the header and signatures
+MIN_REPLY_INTERVAL = 3  # Seconds the chain enforces between two comments of one account
+
+class ReplyPacer:
+    """Spaces out the comments of one account, shared by everything that posts as it."""
+
+    def __init__(self, interval=MIN_REPLY_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_comment = 0.0
+
+    def wait(self):
+        """Sleep until the next comment is allowed and reserve that slot."""
+        with self.lock:
+            slot = max(time.monotonic(), self.last_comment + self.interval)
+            self.last_comment = slot
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+# Shared pacer of the bot account
+reply_pacer = ReplyPacer()
+
+class Outbox:
+    """Collects outgoing operations and broadcasts them in as few transactions as the chain allows.
+
+    Transfers need the active key and are packed together up to MAX_TX_SIZE bytes.
+    Comments need the posting key, which may not share a transaction with active
+    operations, and an account may only comment once every MIN_REPLY_INTERVAL
+    seconds, so each comment goes out in its own paced transaction.
+    """
+
+    def __init__(self, hive, account, max_tx_size=MAX_TX_SIZE, pacer=reply_pacer):
+        self.hive = hive
+        self.account = account
+        self.max_tx_size = max_tx_size
+        self.pacer = pacer
+        self.transfers = []  # (description, operation)
+        self.comments = []
+        self.lock = threading.Lock()
+
+    def transfer(self, to_account, amount, asset, memo):
+        op = operations.Transfer(**{
+            'from': self.account,
+            'to': to_account,
+            'amount': Amount(amount, asset, blockchain_instance=self.hive),
+            'memo': memo,
+            'prefix': self.hive.prefix,
+            'json_str': not bool(self.hive.config['use_condenser'])
+        })
+        with self.lock:
+            self.transfers.append((f"transfer of {amount} {asset} to {to_account}", op))
+
+    def comment(self, parent_author, parent_permlink, permlink, body, json_metadata=None):
+        op = operations.Comment(**{
+            'parent_author': parent_author,
+            'parent_permlink': parent_permlink,
+            'author': self.account,
+            'permlink': permlink,
+            'title': '',
+            'body': body,
+            'json_metadata': json.dumps(json_metadata or {}),
+            'prefix': self.hive.prefix
+        })
+        with self.lock:
+            self.comments.append((f"comment {self.account}/{permlink}", op))
+
+    def _batches(self, entries):
+        batch = []
+        size = 0
+        for entry in entries:
+            op_size = len(bytes(entry[1]))
+            if batch and size + op_size > self.max_tx_size:
+                yield batch
+                batch = []
+                size = 0
+            batch.append(entry)
+            size += op_size
+        if batch:
+            yield batch
+
+    def _send(self, batch, permission, results):
+        try:
+            tx = TransactionBuilder(blockchain_instance=self.hive)
+            tx.appendOps([op for _, op in batch])
+            tx.appendSigner(self.account, permission)
+            tx.sign()
+            tx.broadcast()
+            results.extend({'operation': description, 'ok': True, 'error': None} for description, _ in batch)
+        except Exception as e:
+            # A transport error can hide a transaction the node accepted, sending it again could pay twice
+            if len(batch) == 1 or not isinstance(e, RPCError):
+                logger.error(f"Broadcasting {', '.join(description for description, _ in batch)} failed: {e}")
+                results.extend({'operation': description, 'ok': False, 'error': str(e)} for description, _ in batch)
+                return
+            # The node rejected the transaction, one bad operation fails all of them, so isolate it
+            logger.warning(f"Transaction of {len(batch)} operations failed ({e}). Retrying them one by one.")
+            for entry in batch:
+                self._send([entry], permission, results)
+
+    def clear(self):
+        """Drop everything queued and return how many operations were dropped."""
+        with self.lock:
+            dropped = len(self.transfers) + len(self.comments)
+            self.transfers = []
+            self.comments = []
+        return dropped
+
+    def flush(self):
+        """Broadcast everything queued and return one {'operation', 'ok', 'error'} result per operation."""
+        with self.lock:
+            transfers, self.transfers = self.transfers, []
+            comments, self.comments = self.comments, []
+        results = []
+        batches = list(self._batches(transfers))
+        for batch in batches:
+            self._send(batch, 'active', results)
+        for entry in comments:
+            self.pacer.wait()
+            self._send([entry], 'posting', results)
+        if results:
+            succeeded = sum(1 for result in results if result['ok'])
+            logger.info(f"Outbox broadcast {succeeded} of {len(results)} operations "
+                        f"({len(transfers)} transfers in {len(batches)} transactions, {len(comments)} comments).")
+        return results
@@ -1,16 +1,19 @@
 import os
 import sys
-from datetime import datetime, timedelta
-from beem import Hive
-from beem.comment import Comment
-from beem.exceptions import MissingKeyError
 from dotenv import load_dotenv
 from context_helper import find_context_keywords
+from context_packer import pack_messages
+from hive_content import get_ancestors, get_content
+from conversation_store import conversation_store
+from broadcaster import broadcaster
+from resilience import retry_call, get_breaker, is_transient
+from metrics import metrics
 import logging
 import requests
 import json
 import re
-import time  # Import the time module to use time.sleep()
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
@@ -21,12 +24,17 @@ load_dotenv()
 
 # Get environment variables
 ACCOUNT = os.getenv('ACCOUNT')
-POSTING_KEY = os.getenv('POSTING_KEY')
 API_KEY = os.getenv('API_KEY')
 
 # Constants
-MAX_MESSAGE_LENGTH = 18000
-PRUNE_THRESHOLD = 8 * MAX_MESSAGE_LENGTH
+MAX_LINK_FETCHES = int(os.getenv('MAX_LINK_FETCHES', 4))  # Linked threads fetched at once for one reply
+LINK_DEADLINE = float(os.getenv('LINK_DEADLINE', 5))  # Seconds a single linked thread may take
+MAX_RESPONSE_LENGTH = 1100  # Characters a reply may have
+MAX_RESPONSE_TOKENS = int(os.getenv('MAX_RESPONSE_TOKENS', 400))  # Output limit sent to the backend, a little above MAX_RESPONSE_LENGTH
+STREAM_CHUNK_SIZE = 256  # Bytes read at a time from a streamed response
+LLM_MODEL = "llama-3.3-70b"
+LLM_RETRY_DELAY = float(os.getenv('LLM_RETRY_DELAY', 2))  # First backoff step between talk-to-gpt attempts
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', 180))  # Seconds all attempts of one answer may take together
 
 BASE_URL = "https://nano-gpt.com/api"
 headers = {
@@ -34,10 +42,29 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# Repeated backend failures open the circuit, later mentions then skip it until it recovers
+llm_breaker = get_breaker(BASE_URL)
+
 # Corrected regex pattern for URLs
 URL_REGEX = re.compile(r'https://inleo.io/threads/(?:view/)?(\w+)/([-.\w]+)(?:\?[^?]+)?')
+# Ends of sentences and lines, where a long response can be cut without breaking a thought
+SENTENCE_END = re.compile(r'[.!?:)](?=\s)|\n')
+
+def trim_to_boundary(text, limit=MAX_RESPONSE_LENGTH):
+    """Cut text to at most limit characters at the last paragraph, sentence or word boundary."""
+    if len(text) <= limit:
+        return text
+    head = text[:limit + 1]
+    paragraph = head.rfind('\n\n', 0, limit)
+    if paragraph >= limit // 2:
+        return head[:paragraph].rstrip()
+    sentence_ends = [match.end() for match in SENTENCE_END.finditer(head) if match.end() <= limit]
+    if sentence_ends and sentence_ends[-1] >= limit // 2:
+        return head[:sentence_ends[-1]].rstrip()
+    space = head.rfind(' ', 0, limit)
+    return head[:space if space > 0 else limit].rstrip()
 
-def talk_to_gpt(prompt, system_prompt=None, model="llama-3.3-70b", messages=[], max_retries=3, timeout=90):
+def talk_to_gpt(prompt, system_prompt=None, model=LLM_MODEL, messages=[], max_retries=3, timeout=90):
     if system_prompt is None:
         system_prompt = """You are a general purpose chatbot on a social media website called inleo.io.
 * Each of your messages should be less than 999 characters. Try to adjust to the sweet spot above 850 characters.
@@ -53,137 +80,173 @@ def talk_to_gpt(prompt, system_prompt=None, model="llama-3.3-70b", messages=[],
 * All of your responses should be formatted in a beautiful, easy-to-read markdown format.
 * Always add two line breaks after each paragraph, and after the last bullet point in a section."""
     messages.insert(0, {"role": "system", "content": system_prompt})
-    for attempt in range(1, max_retries + 1):
-        try:
-            data = {
-                "prompt": prompt,
-                "model": model,
-                "messages": messages
-            }
-            response = requests.post(f"{BASE_URL}/talk-to-gpt", headers=headers, json=data, timeout=timeout)
-            if response.status_code == 200:
-                response_text = response.text.strip()
-                # Split the response to separate the text and NanoGPT info parts
-                parts = response_text.split('<NanoGPT>')
-                if len(parts) > 1:
-                    # Extract the text response (everything before <NanoGPT>)
-                    text_response = parts[0].strip()
-                    logger.info(f"Extracted text response from response. Attempt {attempt}.")
-                    if len(text_response) <= 1100:
-                        return text_response
-                    else:
-                        logger.warning(f"Response too long (attempt {attempt}): {len(text_response)} characters.")
-                else:
-                    logger.info(f"No <NanoGPT> delimiter found. Returning raw response. Attempt {attempt}.")
-                    if len(response_text) <= 1100:
-                        return response_text
-                    else:
-                        logger.warning(f"Response too long (attempt {attempt}): {len(response_text)} characters.")
-            else:
-                logger.error(f"Error {response.status_code}: {response.text}. Attempt {attempt}.")
-        except requests.RequestException as e:
-            if isinstance(e, requests.Timeout):
-                logger.warning(f"Request timed out after {timeout} seconds. Attempt {attempt}.")
-            else:
-                logger.error(f"An error occurred: {e}. Attempt {attempt}.")
-    logger.error("All attempts failed to get a valid response.")
-    return None
+    data = {
+        "prompt": prompt,
+        "model": model,
+        "messages": messages,
+        "max_tokens": MAX_RESPONSE_TOKENS
+    }
+
+    def request_answer():
+        # Read the response as it is generated so an overlong answer can be cut short
+        with requests.post(f"{BASE_URL}/talk-to-gpt", headers=headers, json=data, timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                raise requests.HTTPError(f"Error {response.status_code}: {response.text}")
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            deadline = time.monotonic() + timeout
+            response_text = ''
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True):
+                response_text += chunk
+                if '<NanoGPT>' in response_text:
+                    # Everything after <NanoGPT> is usage info, the text response is complete
+                    response_text = response_text.split('<NanoGPT>')[0]
+                    break
+                if len(response_text) > MAX_RESPONSE_LENGTH + len('<NanoGPT>'):
+                    # Closing the stream stops the generation, the text is cut at a boundary below
+                    logger.warning(f"Response passed {MAX_RESPONSE_LENGTH} characters. Stopping the stream.")
+                    break
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(f"Request timed out after {timeout} seconds.")
+        response_text = response_text.strip()
+        text_response = trim_to_boundary(response_text)
+        if not text_response:
+            raise requests.RequestException("Empty response.")
+        if len(text_response) < len(response_text):
+            logger.info(f"Trimmed response from {len(response_text)} to {len(text_response)} characters.")
+        return text_response
+
+    try:
+        return retry_call(request_answer, "talk-to-gpt request", attempts=max_retries, base_delay=LLM_RETRY_DELAY,
+                          deadline=LLM_DEADLINE, breaker=llm_breaker, retry_on=(requests.RequestException,))
+    except Exception as e:
+        logger.error(f"All attempts failed to get a valid response: {e}")
+        # An open circuit, a spent deadline or a backend outage fails the window, which is retried later
+        if is_transient(e):
+            raise
+        return None
 
 def post_reply(parent_comment, reply_text):
+    """Queue a reply on the shared broadcaster and return its permlink."""
     # Replace "@llamathreads" with "`llamathreads`" to prevent tagging
     reply_text = reply_text.replace('@llamathreads', '`llamathreads`')
-    hive = Hive(node='https://api.hive.blog', keys=[POSTING_KEY])
-    try:
-        # Generate a unique permlink for your comment and convert it to lowercase
-        permlink = f"re-{parent_comment['author']}-{parent_comment['permlink']}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}"
-        permlink = permlink.lower()
-        result = hive.post(
-            title="",  # Leave empty for a comment
-            body=reply_text,
-            author=ACCOUNT,
-            permlink=permlink,
-            reply_identifier=f"{parent_comment['author']}/{parent_comment['permlink']}",
-            json_metadata={"app": "leothreads/0.3"}  # Use Leothreads interface for posting to the blockchain
-        )
-        logger.info(f"Reply posted successfully: {result}")
-        print("waiting for blockchain...")
-        time.sleep(3)  # Wait for 3 seconds
-        print("continuing...")
-    except MissingKeyError:
-        logger.error("Missing posting key. Please check your POSTING_KEY in the .env file.")
-    except Exception as e:
-        logger.error(f"An error occurred while posting the reply: {e}")
-        logger.debug(str(e))
+    permlink = broadcaster.submit(parent_comment, reply_text)
+    logger.info(f"Reply to @{parent_comment['author']}/{parent_comment['permlink']} queued as {permlink}")
+    return permlink
+
+def resolve_references(references):
+    """Fetch linked threads concurrently and return them keyed by "author/permlink".
 
-def fetch_referenced_comments(message_body, referencing_author):
+    Repeated links are fetched once, at most MAX_LINK_FETCHES run at a time, and a link
+    that misses its LINK_DEADLINE is left out instead of stalling the reply.
+    """
+    unique_references = list(dict.fromkeys(references))
+    resolved = {}
+    if not unique_references:
+        return resolved
+    executor = ThreadPoolExecutor(max_workers=min(MAX_LINK_FETCHES, len(unique_references)), thread_name_prefix='links')
+    futures = {executor.submit(get_content, author, permlink, LINK_DEADLINE): (author, permlink) for author, permlink in unique_references}
+    # Links queue behind the per-request cap, so the whole batch gets one deadline per round
+    rounds = -(-len(unique_references) // MAX_LINK_FETCHES)
+    done, not_done = wait(futures, timeout=LINK_DEADLINE * rounds)
+    for future in done:
+        author, permlink = futures[future]
+        try:
+            referenced_comment = future.result()
+            if referenced_comment is not None:
+                resolved[f"{author}/{permlink}"] = referenced_comment
+        except Exception as e:
+            logger.error(f"Error fetching referenced comment @{author}/{permlink}: {e}")
+    for future in not_done:
+        author, permlink = futures[future]
+        logger.warning(f"Referenced comment @{author}/{permlink} missed its {LINK_DEADLINE}s deadline. Skipping.")
+    executor.shutdown(wait=False, cancel_futures=True)
+    return resolved
+
+def fetch_referenced_comments(message_body, referencing_author, resolved=None, skip=()):
+    """Build the link messages of one message body.
+
+    resolved holds linked threads fetched ahead by resolve_references; links in skip
+    were already shared earlier in the conversation and are left out.
+    """
     # Use the corrected regex pattern
-    references = URL_REGEX.findall(message_body)
+    references = list(dict.fromkeys(URL_REGEX.findall(message_body)))
     referenced_messages = []
+    if not references:
+        return referenced_messages
+    if resolved is None:
+        resolved = resolve_references(references)
     for referenced_author, permlink in references:
-        try:
-            referenced_comment = Comment(f"@{referenced_author}/{permlink}")
-            referenced_body = referenced_comment.get('body', '')
-            # Construct the URL
-            referenced_url = f"https://inleo.io/threads/view/{referenced_author}/{permlink}"
-            # Preface the body with the URL and the referencing author
-            prefixed_body = f"@{referencing_author} shared this {referenced_url} by @{referenced_author}\nLink's content:\n{referenced_body}"
-            referenced_messages.append({"role": "user", "content": prefixed_body})
-            logger.info(f"Referenced message added for @{referenced_author}/{permlink} by @{referencing_author}")
-        except MissingKeyError:
-            logger.error(f"Missing posting key. Please check your POSTING_KEY in the .env file.")
-        except Exception as e:
-            logger.error(f"Error fetching referenced comment @{referenced_author}/{permlink} by @{referencing_author}: {e}")
+        if (referenced_author, permlink) in skip:
+            continue
+        referenced_comment = resolved.get(f"{referenced_author}/{permlink}")
+        if referenced_comment is None:
+            logger.error(f"Error fetching referenced comment @{referenced_author}/{permlink} by @{referencing_author}")
+            continue
+        referenced_body = referenced_comment.get('body', '')
+        # Construct the URL
+        referenced_url = f"https://inleo.io/threads/view/{referenced_author}/{permlink}"
+        # Preface the body with the URL and the referencing author
+        prefixed_body = f"@{referencing_author} shared this {referenced_url} by @{referenced_author}\nLink's content:\n{referenced_body}"
+        referenced_messages.append({"role": "user", "content": prefixed_body})
+        logger.info(f"Referenced message added for @{referenced_author}/{permlink} by @{referencing_author}")
     return referenced_messages
 
 def fetch_comment_chain(comment, blacklist=['leothreads']) -> list:
     messages = []
-    current_comment = comment
-    while current_comment:
+    stored = None
+    hops = []
+    # The walk stops at a comment the bot already answered, whose context is in the conversation store
+    chain = [comment] + get_ancestors(comment.get('parent_author', ''), comment.get('parent_permlink', ''), blacklist,
+                                      until=lambda comment_id: comment_id in conversation_store)
+    for current_comment in chain:
         author = current_comment.get('author', '')
         permlink = current_comment.get('permlink', '')
-        body = current_comment.get('body', '')
         if author in blacklist:
             logger.info(f"Skipped blacklisted user: @{author}/{permlink}")
             break
+        stored = conversation_store.load(f"{author}/{permlink}") if current_comment is not comment else None
+        if stored:
+            # Only the new hops are assembled, the rest of the thread is reused as is
+            logger.info(f"Reusing stored conversation for @{author}/{permlink}")
+            break
+        hops.append(current_comment)
+
+    # Resolve the links of all new hops at once; a link is only shared once per conversation
+    resolved = resolve_references([reference for hop in hops for reference in URL_REGEX.findall(hop.get('body', ''))])
+    shared = set()
+    for message in (stored['messages'] if stored else []):
+        if "\nLink's content:\n" in message['content']:
+            shared.update(URL_REGEX.findall(message['content'].split('\n', 1)[0]))
+    for current_comment in hops:
+        author = current_comment.get('author', '')
+        permlink = current_comment.get('permlink', '')
+        body = current_comment.get('body', '')
         role = "assistant" if author.lower() == "llamathreads" else f"user_{author}"
         # Preface the body with the author's username and a line break
         prefixed_body = f"post by @{author}:\n{body}" if role != "assistant" else f"{body}"
         message = {"role": role, "content": prefixed_body}
         messages.append(message)
         logger.info(f"Added a message: @{author}/{permlink}")
-        # Fetch referenced comments
-        referenced_messages = fetch_referenced_comments(body, author)
+        # Add the referenced comments
+        referenced_messages = fetch_referenced_comments(body, author, resolved, skip=shared)
         messages.extend(referenced_messages)
-        # Check if the current comment is a blog post (no parent author or parent permlink)
-        parent_author = current_comment.get('parent_author', '')
-        parent_permlink = current_comment.get('parent_permlink', '')
-        if not parent_author or not parent_permlink:
-            logger.info(f"No parent author or parent permlink found for @{author}/{permlink}. Stopping chain trace.")
-            break
-        try:
-            # Fetch the parent comment
-            parent_comment = Comment(f"@{parent_author}/{parent_permlink}")
-            # Safely retrieve values from parent_comment
-            parent_author = parent_comment.get('author', '')
-            parent_permlink = parent_comment.get('permlink', '')
-            parent_body = parent_comment.get('body', '')
-            parent_parent_author = parent_comment.get('parent_author', '')
-            parent_parent_permlink = parent_comment.get('parent_permalink', '')
-            current_comment = {
-                'author': parent_author,
-                'permlink': parent_permlink,
-                'body': parent_body,
-                'parent_author': parent_parent_author,
-                'parent_permlink': parent_parent_permlink
-            }
-        except MissingKeyError:
-            logger.error("Missing posting key. Please check your POSTING_KEY in the .env file.")
-        except Exception as e:
-            logger.error(f"Error fetching parent comment @{parent_author}/{parent_permlink}: {e}")
-            break
+        shared.update(URL_REGEX.findall(body))
     
-    # Find context keywords and add them to messages
-    context_messages = find_context_keywords(messages)
+    # Find context keywords in the new hops and add them to the stored context
+    with metrics.timed('keyword_match'):
+        context_messages = find_context_keywords(messages)
+    if stored:
+        known_context = {msg['content'] for msg in stored['context']}
+        context_messages = stored['context'] + [msg for msg in context_messages if msg['content'] not in known_context]
+        messages.extend(stored['messages'])
+        root_id = stored['root_id']
+    else:
+        root_id = f"{chain[-1].get('author', '')}/{chain[-1].get('permlink', '')}"
+    try:
+        conversation_store.save(f"{comment['author']}/{comment['permlink']}", root_id, messages, context_messages)
+    except Exception as e:
+        logger.error(f"Error storing conversation for @{comment['author']}/{comment['permlink']}: {e}")
     
     # Add HIGH priority context messages to the start as system messages
     high_priority_messages = [msg for msg in context_messages if msg['role'] == 'system']
@@ -203,20 +266,7 @@ def fetch_comment_chain(comment, blacklist=['leothreads']) -> list:
     # Reverse the messages to maintain historical order
     messages.reverse()
 
-    # Prune messages if their total combined length is above the threshold
-    while True:
-        total_length = sum(len(msg['content']) for msg in messages)
-        if total_length <= PRUNE_THRESHOLD:
-            break
-        # Remove the oldest message
-        removed_message = messages.pop(0)
-        logger.info(f"Removed oldest message: @{removed_message['content'].split(':', 1)[0]}")
-        logger.info(f"New total length: {total_length} -> {sum(len(msg['content']) for msg in messages)}")
-    
-    # Truncate the last message to fit within MAX_MESSAGE_LENGTH if necessary
-    if messages and len(messages[-1]['content']) > MAX_MESSAGE_LENGTH:
-        logger.info(f"Truncating the last message to fit within {MAX_MESSAGE_LENGTH} characters.")
-        messages[-1]['content'] = messages[-1]['content'][:MAX_MESSAGE_LENGTH]
-        logger.info(f"Truncated message length: {len(messages[-1]['content'])}")
+    # Fit the messages into the token budget, evicting by priority class and age
+    messages = pack_messages(messages, comment.get('author', ''))
     
     return messages
\ No newline at end of file
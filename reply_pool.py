@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from reply import talk_to_gpt, post_reply, fetch_comment_chain, LLM_MODEL
+from llm_cache import response_cache, request_key
+from metrics import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Pool size and per-stage limits, raise them to push throughput during mention spikes
+REPLY_WORKERS = int(os.getenv('REPLY_WORKERS', 4))
+CHAIN_CONCURRENCY = int(os.getenv('CHAIN_CONCURRENCY', REPLY_WORKERS))
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', REPLY_WORKERS))
+
+def group_by_thread(comments):
+    """Group comments so that replies within one conversation keep their block order.
+
+    Comments sharing a parent, or replying to another comment of the same window,
+    end up in the same group.
+    """
+    groups = {}
+    group_of = {}
+    for comment in comments:
+        parent_id = f"{comment['parent_author']}/{comment['parent_permlink']}"
+        key = group_of.get(parent_id, parent_id)
+        group_of[f"{comment['author']}/{comment['permlink']}"] = key
+        groups.setdefault(key, []).append(comment)
+    return list(groups.values())
+
+class ReplyPool:
+    """Bounded worker pool that answers comments concurrently across threads.
+
+    Chain building and LLM generation run in parallel up to their own limits,
+    while replies are handed to the shared broadcaster, which posts them one at
+    a time at the chain's pace.
+    """
+
+    def __init__(self, workers=REPLY_WORKERS, chain_concurrency=CHAIN_CONCURRENCY, llm_concurrency=LLM_CONCURRENCY):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reply')
+        self.chain_slots = threading.BoundedSemaphore(chain_concurrency)
+        self.llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        logger.info(f"Reply pool started with {workers} workers (chain: {chain_concurrency}, llm: {llm_concurrency}).")
+
+    def build_chain(self, comment):
+        with self.chain_slots, metrics.timed('chain_build'):
+            return fetch_comment_chain(comment)
+
+    def _generate(self, prompt, messages):
+        with self.llm_slots, metrics.timed('llm_request'):
+            response = talk_to_gpt(prompt, system_prompt=None, model=LLM_MODEL, messages=messages)
+        # talk_to_gpt raises on outages and reports any other failed request by returning None
+        if response is None:
+            metrics.inc('llm_request_errors_total')
+        return response
+
+    def generate(self, prompt, messages, author=None):
+        """Answer a prompt, reusing the answer of an identical recent or running request."""
+        # Waiting on a running duplicate must not hold one of the LLM slots
+        key = request_key(LLM_MODEL, None, prompt, messages, author)
+        return response_cache.get_or_generate(key, lambda: self._generate(prompt, messages), author)
+
+    def broadcast(self, comment, reply_text):
+        return post_reply(comment, reply_text)
+
+    def _run_group(self, comments, handler):
+        for index, comment in enumerate(comments):
+            try:
+                handler(comment)
+            except Exception:
+                # The rest of the group is dropped with the error
+                metrics.add('pending_comments', index - len(comments))
+                raise
+            metrics.add('pending_comments', -1)
+
+    def run(self, comments, handler):
+        """Run handler over every comment and wait for the whole window to finish.
+
+        The first error is re-raised once all groups are done, so callers keep
+        their existing error handling.
+        """
+        metrics.add('pending_comments', len(comments))
+        groups = group_by_thread(comments)
+        futures = [self.executor.submit(self._run_group, group, handler) for group in groups]
+        first_error = None
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error while processing a comment group: {e}")
+                first_error = first_error or e
+        if first_error:
+            raise first_error
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
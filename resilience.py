@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import random
+import threading
+import logging
+from collections import deque
+import requests
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.5))  # First backoff step in seconds
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 10))  # Backoff steps never exceed this
+BREAKER_WINDOW = 10  # Recent calls per endpoint a breaker looks at
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 3))  # Failures within the window that open a breaker
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', 30))  # Seconds an open breaker waits before a trial call
+BREAKER_MAX_RESET = float(os.getenv('BREAKER_MAX_RESET', 300))  # Upper bound of the doubling reset time
+
+class TransientError(Exception):
+    """Base of errors that are expected to go away when retried later."""
+
+class CircuitOpenError(TransientError):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+class DeadlineExceeded(TransientError):
+    """Raised when retries run out of their overall time budget."""
+
+def is_transient(error):
+    """Whether an error is worth retrying later rather than stopping for."""
+    return isinstance(error, (TransientError, requests.RequestException, TimeoutError, ConnectionError))
+
+def backoff_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter for the given (1-based) attempt."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+class Deadline:
+    """Overall time budget shared by the attempts of one operation."""
+
+    def __init__(self, seconds):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one endpoint.
+
+    The breaker opens once BREAKER_FAILURES of the last BREAKER_WINDOW calls
+    failed, so a flapping endpoint trips as well as a dead one. After the reset
+    time a trial call is let through: success closes the breaker, failure opens
+    it again for twice as long, up to BREAKER_MAX_RESET.
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset=BREAKER_RESET, max_reset=BREAKER_MAX_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.max_reset = max_reset
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.open_until = 0.0
+        self.current_reset = reset
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        """Whether calls are being refused right now, without claiming a trial call."""
+        with self.lock:
+            return self.open_until > time.monotonic() or (self.open_until > 0 and self.trial_running)
+
+    def allow(self):
+        """Whether a call may go out now; claims the trial call of a half-open breaker."""
+        with self.lock:
+            if self.open_until == 0.0:
+                return True
+            if self.open_until > time.monotonic() or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record(self, ok):
+        with self.lock:
+            self.outcomes.append(ok)
+            if self.open_until:
+                self.trial_running = False
+                if ok:
+                    logger.info(f"Circuit of {self.name} closed again.")
+                    self.open_until = 0.0
+                    self.current_reset = self.reset
+                    self.outcomes.clear()
+                elif self.open_until <= time.monotonic():
+                    self.current_reset = min(self.current_reset * 2, self.max_reset)
+                    self.open_until = time.monotonic() + self.current_reset
+                    logger.warning(f"Trial call to {self.name} failed, circuit open for {self.current_reset:.0f}s.")
+                return
+            if not ok and self.outcomes.count(False) >= self.failures:
+                self.open_until = time.monotonic() + self.current_reset
+                logger.warning(f"Circuit of {self.name} opened for {self.current_reset:.0f}s after {self.outcomes.count(False)} recent failures.")
+
+# One breaker per endpoint, shared by every module
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name, **settings):
+    """Return the circuit breaker of an endpoint, creating it with settings on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **settings)
+        return breaker
+
+def retry_call(func, description, attempts=5, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+               deadline=None, breaker=None, retry_on=(Exception,)):
+    """Call func() until it succeeds, backing off exponentially with jitter between attempts.
+
+    deadline is an overall budget in seconds (or a Deadline): no attempt starts
+    once it is spent and no backoff sleeps past it. With a breaker, an open
+    circuit fails fast with CircuitOpenError and every outcome is recorded.
+    The last error is re-raised when the attempts or the deadline run out.
+    """
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    last_error = None
+    for attempt in range(1, attempts + 1):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"Circuit of {breaker.name} is open, skipping {description}.")
+        try:
+            result = func()
+        except retry_on as e:
+            if breaker is not None:
+                breaker.record(False)
+            last_error = e
+            if attempt == attempts:
+                break
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            remaining = deadline.remaining()
+            if remaining is not None and delay >= remaining:
+                logger.warning(f"{description} failed (attempt {attempt}/{attempts}): {e}. Deadline reached.")
+                raise DeadlineExceeded(f"{description} ran out of time after {attempt} attempts: {e}") from e
+            logger.warning(f"{description} failed (attempt {attempt}/{attempts}): {e}. Retrying in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record(True)
+        return result
+    logger.error(f"{description} failed after {attempts} attempts.")
+    raise last_error
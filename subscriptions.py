@@ -0,0 +1,84 @@
+import os
+import sys
+import heapq
+import threading
+import logging
+from datetime import datetime
+from leosub import list_all_subscriptions
+from metrics import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+SUBSCRIPTION_REFRESH_INTERVAL = int(os.getenv('SUBSCRIPTION_REFRESH_INTERVAL', 300))  # Seconds between background refreshes
+
+class SubscriptionIndex:
+    """Subscribers, free-trial users and buyers in hashed sets with live expiry.
+
+    Expiry times sit in a min-heap and are applied on every lookup, so a
+    subscription ends the moment it is due. A background thread refreshes the
+    index from leosub without blocking lookups.
+    """
+
+    KINDS = ('subscribers', 'freetrial', 'buyers')
+
+    def __init__(self, source=list_all_subscriptions, refresh_interval=SUBSCRIPTION_REFRESH_INTERVAL):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.members = {kind: {} for kind in self.KINDS}
+        self.expiries = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def load(self, subscriptions):
+        """Replace the index with {kind: {username: expiry or None}}."""
+        members = {kind: dict(subscriptions.get(kind, {})) for kind in self.KINDS}
+        expiries = [(expiry, kind, username) for kind, users in members.items() for username, expiry in users.items() if expiry]
+        heapq.heapify(expiries)
+        with self.lock:
+            self.members = members
+            self.expiries = expiries
+            self._expire()
+        counts = ', '.join(f"{kind}: {len(users)}" for kind, users in self.members.items())
+        logger.info(f"Subscription index loaded ({counts}).")
+
+    def _expire(self):
+        now = datetime.utcnow()
+        while self.expiries and self.expiries[0][0] <= now:
+            expiry, kind, username = heapq.heappop(self.expiries)
+            # Ignore heap entries whose expiry no longer matches the member
+            if self.members[kind].get(username) == expiry:
+                del self.members[kind][username]
+                logger.info(f"{kind} entry of {username} expired at {expiry}.")
+
+    def __contains__(self, username):
+        with self.lock:
+            self._expire()
+            return any(username in users for users in self.members.values())
+
+    def __len__(self):
+        with self.lock:
+            self._expire()
+            return len(set().union(*self.members.values()))
+
+    def refresh(self):
+        with metrics.timed('subscription_refresh'):
+            self.load(self.source())
+
+    def _run(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing the subscription index: {e}")
+
+    def start(self):
+        """Refresh the index every refresh_interval seconds on a background thread."""
+        self.thread = threading.Thread(target=self._run, name='subscriptions', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
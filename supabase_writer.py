@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import threading
+import logging
+from metrics import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+logger = logging.getLogger()
+
+# Constants
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 500))  # Pending rows that trigger a flush
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', 10))  # Seconds after which pending rows are flushed
+
+class WriteBuffer:
+    """Write-behind buffer that turns row-by-row Supabase writes into bulk calls.
+
+    Inserts, updates, upserts and deletes are grouped per table and key column; a
+    later write to the same key replaces an earlier one. upsert() relies on a
+    unique constraint on the key column, insert() and update() work without one.
+    Pending writes go out once WRITE_BATCH_SIZE rows are queued, once
+    WRITE_FLUSH_INTERVAL seconds passed since the last flush, or when flush() is
+    called at a checkpoint.
+    """
+
+    def __init__(self, client, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserts = {}  # (table, key) -> {key value: row}
+        self.updates = {}
+        self.upserts = {}
+        self.deletes = {}  # (table, key) -> set of key values
+        self.lock = threading.RLock()
+        self.last_flush = time.monotonic()
+
+    def _pending(self):
+        return (sum(len(rows) for writes in (self.inserts, self.updates, self.upserts) for rows in writes.values())
+                + sum(len(values) for values in self.deletes.values()))
+
+    def _queue(self, kind, table, row, key):
+        with self.lock:
+            self.deletes.get((table, key), set()).discard(row[key])
+            getattr(self, kind).setdefault((table, key), {})[row[key]] = row
+            self._flush_if_due()
+
+    def insert(self, table, row, key):
+        """Queue a row that is known not to exist yet."""
+        self._queue('inserts', table, row, key)
+
+    def update(self, table, row, key):
+        """Queue new values for the existing row whose key column equals row[key]."""
+        self._queue('updates', table, row, key)
+
+    def upsert(self, table, row, key):
+        self._queue('upserts', table, row, key)
+
+    def delete(self, table, key, value):
+        with self.lock:
+            for writes in (self.inserts, self.updates, self.upserts):
+                writes.get((table, key), {}).pop(value, None)
+            self.deletes.setdefault((table, key), set()).add(value)
+            self._flush_if_due()
+
+    def _flush_if_due(self):
+        if self._pending() >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all pending rows and return {table: rows written}.
+
+        If a call fails, the rows not written yet go back into the buffer for the
+        next flush and the error is re-raised.
+        """
+        with self.lock:
+            deletes, self.deletes = self.deletes, {}
+            inserts, self.inserts = self.inserts, {}
+            updates, self.updates = self.updates, {}
+            upserts, self.upserts = self.upserts, {}
+            self.last_flush = time.monotonic()
+            written = {}
+            try:
+                for (table, key), values in list(deletes.items()):
+                    if values:
+                        with metrics.timed('supabase', operation='delete'):
+                            self.client.table(table).delete().in_(key, list(values)).execute()
+                        written[table] = written.get(table, 0) + len(values)
+                        logger.info(f"Deleted {len(values)} rows from {table}.")
+                    del deletes[(table, key)]
+                for (table, key), rows in list(inserts.items()):
+                    if rows:
+                        with metrics.timed('supabase', operation='insert'):
+                            self.client.table(table).insert(list(rows.values())).execute()
+                        written[table] = written.get(table, 0) + len(rows)
+                        logger.info(f"Inserted {len(rows)} rows into {table}.")
+                    del inserts[(table, key)]
+                for (table, key), rows in list(updates.items()):
+                    count = len(rows)
+                    # An update sets the same values on every matched row, so each row needs its own call
+                    for value in list(rows):
+                        with metrics.timed('supabase', operation='update'):
+                            self.client.table(table).update(rows[value]).eq(key, value).execute()
+                        del rows[value]
+                    if count:
+                        written[table] = written.get(table, 0) + count
+                        logger.info(f"Updated {count} rows in {table}.")
+                    del updates[(table, key)]
+                for (table, key), rows in list(upserts.items()):
+                    if rows:
+                        with metrics.timed('supabase', operation='upsert'):
+                            self.client.table(table).upsert(list(rows.values()), on_conflict=key).execute()
+                        written[table] = written.get(table, 0) + len(rows)
+                        logger.info(f"Upserted {len(rows)} rows into {table}.")
+                    del upserts[(table, key)]
+            except Exception:
+                # The buffer stays locked during a flush, so nothing newer was queued in the meantime
+                self.deletes = deletes
+                self.inserts = inserts
+                self.updates = updates
+                self.upserts = upserts
+                raise
+            return written